@@ -20,6 +20,7 @@ hiddenimports += [
     'webview',
     'flask',
     'markdown',
+    'code_highlight',  # loaded by name as a Markdown extension
     'markitdown',
     'PIL',
     'PIL.Image',
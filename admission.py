@@ -0,0 +1,196 @@
+"""
+MarkForge - Admission control for the conversion endpoints
+Each class of traffic (preview, PDF, document conversion) gets its own
+concurrency limit and a short FIFO queue, so slow PDF renders cannot take
+every request thread away from cheap previews. Requests are weighed by an
+estimated cost; when the queue is full, or the work already admitted would
+keep a new request waiting past the class's latency SLO, it is refused at
+once with a retry hint instead of waiting for the gunicorn timeout.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# Cost units are roughly "a kilobyte of plain prose". Features that cost far
+# more than their size to lay out or highlight are weighted on top.
+TABLE_ROW_COST = 0.05
+CODE_BLOCK_COST = 0.5
+IMAGE_COST = 2.0
+# Per-kilobyte weight of uploads by type; PDFs are laid out by pdfminer
+UPLOAD_WEIGHTS = {'.pdf': 3.0, '.pptx': 1.5, '.xlsx': 1.5, '.xls': 1.5, '.docx': 1.0}
+# Learned seconds-per-cost estimates follow recent requests with this weight
+RATE_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 60
+
+
+class Overloaded(Exception):
+    """Raised when a request is refused; retry_after is in whole seconds."""
+
+    def __init__(self, message: str, reason: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def markdown_cost(markdown_text: str) -> float:
+    """Estimated cost of rendering a Markdown document, in cost units."""
+    return (
+        1.0
+        + len(markdown_text) / 1024
+        + markdown_text.count('\n|') * TABLE_ROW_COST
+        + markdown_text.count('```') // 2 * CODE_BLOCK_COST
+        + markdown_text.count('![') * IMAGE_COST
+    )
+
+
+def upload_cost(size: int, extension: str = '') -> float:
+    """Estimated cost of converting an uploaded document to Markdown."""
+    return 1.0 + (size or 0) / 1024 * UPLOAD_WEIGHTS.get((extension or '').lower(), 1.0)
+
+
+class Permit:
+    """An admitted request's slot; release it exactly once when done."""
+
+    def __init__(self, gate: 'AdmissionGate', cost: float):
+        self.gate = gate
+        self.cost = cost
+        self.start = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        # Safe to call again, e.g. from both a streamed body and call_on_close
+        if not self._released:
+            self._released = True
+            self.gate._release(self)
+
+
+class AdmissionGate:
+    """Concurrency limit with a bounded FIFO queue for one class of traffic.
+
+    The gate learns how many seconds a unit of cost takes from the requests
+    it admits, so it can predict how long a new request would wait behind
+    the ones running and queued. concurrency <= 0 admits everything (the
+    requests are still counted).
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, slo_seconds: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max(0, max_queue)
+        self.slo_seconds = slo_seconds
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._active = 0
+        self._active_cost = 0.0
+        self._queued_cost = 0.0
+        self._seconds_per_cost = None
+        self._counts = {'admitted': 0, 'waited': 0, 'shed': 0}
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int, max_queue: int, slo_ms: float) -> 'AdmissionGate':
+        """Gate configured by MARKFORGE_ADMIT_<NAME>_{CONCURRENCY,QUEUE,SLO_MS}."""
+        prefix = f'MARKFORGE_ADMIT_{name.upper()}_'
+        return cls(
+            name,
+            int(os.environ.get(prefix + 'CONCURRENCY', concurrency)),
+            int(os.environ.get(prefix + 'QUEUE', max_queue)),
+            float(os.environ.get(prefix + 'SLO_MS', slo_ms)) / 1000,
+        )
+
+    def _expected_wait(self) -> float:
+        """Seconds until the work ahead of a new request drains, if known."""
+        if self._seconds_per_cost is None:
+            return None
+        return (self._active_cost + self._queued_cost) * self._seconds_per_cost / max(self.concurrency, 1)
+
+    def _retry_after(self) -> int:
+        wait = self._expected_wait()
+        return min(MAX_RETRY_AFTER, max(1, math.ceil(wait or 1)))
+
+    def _shed(self, reason: str, message: str):
+        self._counts['shed'] += 1
+        metrics.ADMISSIONS.inc(traffic=self.name, outcome=f'shed_{reason}')
+        return Overloaded(message, reason, self._retry_after())
+
+    def acquire(self, cost: float) -> Permit:
+        """Admit a request of the given cost or raise Overloaded.
+
+        Waits in the queue for at most the class's SLO; a request that would
+        not start in time is refused before it waits at all.
+        """
+        arrived = time.monotonic()
+        with self._cond:
+            if self.concurrency <= 0 or (self._active < self.concurrency and not self._waiting):
+                return self._admit(cost, arrived)
+            if len(self._waiting) >= self.max_queue:
+                raise self._shed('queue', f'Too many {self.name} requests in progress; try again shortly')
+            wait = self._expected_wait()
+            if wait is not None and wait + cost * self._seconds_per_cost > self.slo_seconds:
+                raise self._shed('slo', f'The {self.name} queue is too long to finish in time; try again shortly')
+
+            ticket = object()
+            self._waiting.append(ticket)
+            self._queued_cost += cost
+            self._counts['waited'] += 1
+            deadline = arrived + self.slo_seconds
+            try:
+                while self._active >= self.concurrency or self._waiting[0] is not ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._shed('timeout', f'Timed out waiting for a {self.name} slot; try again shortly')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                self._queued_cost -= cost
+                # The next in line may be able to start now, or to give up
+                self._cond.notify_all()
+            return self._admit(cost, arrived)
+
+    def _admit(self, cost: float, arrived: float) -> Permit:
+        self._active += 1
+        self._active_cost += cost
+        self._counts['admitted'] += 1
+        metrics.ADMISSIONS.inc(traffic=self.name, outcome='admitted')
+        metrics.ADMISSION_WAIT_SECONDS.observe(time.monotonic() - arrived, traffic=self.name)
+        return Permit(self, cost)
+
+    def _release(self, permit: Permit) -> None:
+        elapsed = time.monotonic() - permit.start
+        with self._cond:
+            self._active -= 1
+            self._active_cost -= permit.cost
+            sample = elapsed / max(permit.cost, 1e-6)
+            if self._seconds_per_cost is None:
+                self._seconds_per_cost = sample
+            else:
+                self._seconds_per_cost += RATE_SMOOTHING * (sample - self._seconds_per_cost)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost: float):
+        """Context manager holding a permit for the duration of the block."""
+        permit = self.acquire(cost)
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    def stats(self) -> dict:
+        """Return current load and admission counters."""
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'max_queue': self.max_queue,
+                'slo_ms': round(self.slo_seconds * 1000),
+                'active': self._active,
+                'queued': len(self._waiting),
+                'expected_wait_ms': None if self._seconds_per_cost is None
+                else round(self._expected_wait() * 1000, 1),
+                **self._counts,
+            }
@@ -12,13 +12,14 @@ import threading
 import sys
 import os
 import base64
+import shutil
 import tempfile
 
 # Add the current directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Import the Flask server
-from server import app as flask_app
+from server import app as flask_app, generate_pdf_file
 
 
 class Api:
@@ -76,6 +77,45 @@ class Api:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def export_pdf(self, markdown_text, page_size, filename):
+        """Render Markdown to PDF and save it via native dialog, without base64."""
+        try:
+            if not self._window:
+                return {'success': False, 'error': 'Window not initialized'}
+            
+            default_dir = os.path.expanduser('~/Downloads')
+            if not os.path.exists(default_dir):
+                default_dir = os.path.expanduser('~/Documents')
+            if not os.path.exists(default_dir):
+                default_dir = os.path.expanduser('~')
+            
+            save_path = self._window.create_file_dialog(
+                webview.SAVE_DIALOG,
+                directory=default_dir,
+                save_filename=filename,
+                file_types=('PDF Files (*.pdf)', 'All files (*.*)')
+            )
+            
+            if save_path:
+                if isinstance(save_path, (list, tuple)):
+                    save_path = save_path[0] if save_path else None
+                
+                if save_path:
+                    if not save_path.lower().endswith('.pdf'):
+                        save_path += '.pdf'
+                    
+                    # Render in-process and copy the spooled file straight to disk
+                    pdf_file, _ = generate_pdf_file(markdown_text, page_size)
+                    with pdf_file, open(save_path, 'wb') as f:
+                        shutil.copyfileobj(pdf_file, f)
+                    
+                    return {'success': True, 'path': save_path}
+            
+            return {'success': False, 'error': 'cancelled'}
+        
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
     def save_markdown(self, content, filename):
         """Save markdown file using native file dialog."""
         try:
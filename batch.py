@@ -0,0 +1,165 @@
+"""
+MarkForge - Batch conversion helpers
+Collects documents for /api/convert-batch and streams a ZIP of PDFs back
+as each render finishes, with a manifest of per-document results.
+"""
+
+import json
+import os
+import posixpath
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MARKDOWN_SUFFIXES = ('.md', '.markdown')
+
+
+class _ZipStream:
+    """Write-only, non-seekable sink that zipfile writes into and we drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _safe_name(name: str) -> str:
+    """Normalise a user supplied document name to a relative path."""
+    name = posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+    parts = [part for part in name.split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts) or 'document.md'
+
+
+def pdf_name(name: str, used: set) -> str:
+    """Map a document name to a unique .pdf name inside the output ZIP."""
+    base, ext = os.path.splitext(_safe_name(name))
+    if ext.lower() not in MARKDOWN_SUFFIXES + ('.txt',):
+        base = base + ext
+    candidate = f'{base}.pdf'
+    counter = 1
+    while candidate in used:
+        candidate = f'{base}-{counter}.pdf'
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def documents_from_json(items: list, max_documents: int) -> list:
+    """Return (name, markdown_text, error) tuples from a JSON documents list."""
+    if not isinstance(items, list):
+        raise ValueError("documents must be a list")
+    if len(items) > max_documents:
+        raise ValueError(f"Too many documents (max {max_documents})")
+    documents = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"documents[{index}] must be an object")
+        name = item.get('name') or f'document-{index + 1}.md'
+        if not isinstance(name, str):
+            raise ValueError(f"documents[{index}].name must be a string")
+        markdown_text = item.get('markdown')
+        if not isinstance(markdown_text, str) or not markdown_text.strip():
+            documents.append((name, None, 'No content provided'))
+        else:
+            documents.append((name, markdown_text, None))
+    return documents
+
+
+def documents_from_zip(fileobj, max_documents: int, max_document_bytes: int,
+                       max_total_bytes: int) -> list:
+    """Return (name, markdown_text, error) tuples for Markdown files in a ZIP.
+
+    Entries larger than max_document_bytes once decompressed are reported
+    as errors; more than max_total_bytes in all raises ValueError.
+    """
+    documents = []
+    total_bytes = 0
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(MARKDOWN_SUFFIXES):
+                continue
+            if posixpath.basename(info.filename).startswith('.'):
+                continue
+            if len(documents) >= max_documents:
+                raise ValueError(f"Too many documents (max {max_documents})")
+            # file_size comes from the archive, so the read is bounded too
+            if info.file_size > max_document_bytes:
+                documents.append((info.filename, None, f'Document too large (max {max_document_bytes} bytes)'))
+                continue
+            try:
+                with archive.open(info) as entry:
+                    data = entry.read(max_document_bytes + 1)
+                if len(data) > max_document_bytes:
+                    documents.append((info.filename, None, f'Document too large (max {max_document_bytes} bytes)'))
+                    continue
+                total_bytes += len(data)
+                if total_bytes > max_total_bytes:
+                    raise ValueError(f"Documents too large in total (max {max_total_bytes} bytes)")
+                markdown_text = data.decode('utf-8')
+            except (UnicodeDecodeError, zipfile.BadZipFile) as e:
+                documents.append((info.filename, None, str(e)))
+                continue
+            if not markdown_text.strip():
+                documents.append((info.filename, None, 'No content provided'))
+            else:
+                documents.append((info.filename, markdown_text, None))
+    return documents
+
+
+def stream_pdf_zip(documents: list, render, workers: int):
+    """Render documents in parallel and yield ZIP bytes as each PDF completes.
+
+    render(markdown_text) returns PDF bytes. Failures are recorded in
+    manifest.json, the last entry of the archive, instead of aborting.
+    """
+    stream = _ZipStream()
+    archive = zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED)
+    used_names = {'manifest.json'}
+    manifest = []
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers),
+                                  thread_name_prefix='markforge-batch')
+    try:
+        futures = {}
+        for name, markdown_text, error in documents:
+            output = pdf_name(name, used_names)
+            if error is not None:
+                manifest.append({'name': name, 'output': None, 'status': 'error', 'error': error})
+                continue
+            futures[executor.submit(render, markdown_text)] = (name, output)
+
+        for future in as_completed(futures):
+            name, output = futures[future]
+            try:
+                pdf_bytes = future.result()
+            except Exception as e:
+                manifest.append({'name': name, 'output': None, 'status': 'error', 'error': str(e)})
+                continue
+            archive.writestr(output, pdf_bytes)
+            manifest.append({'name': name, 'output': output, 'status': 'ok', 'bytes': len(pdf_bytes)})
+            yield stream.drain()
+    finally:
+        # Stop queued renders if the client goes away mid-stream
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    archive.writestr('manifest.json', json.dumps({
+        'documents': manifest,
+        'succeeded': sum(1 for entry in manifest if entry['status'] == 'ok'),
+        'failed': sum(1 for entry in manifest if entry['status'] != 'ok'),
+    }, indent=2))
+    archive.close()
+    yield stream.drain()
@@ -0,0 +1,106 @@
+"""
+MarkForge - Synthetic benchmark corpus
+Deterministic Markdown documents that vary in size, table density,
+code-block count and image count.
+"""
+
+import random
+
+# Name -> document shape. Every document starts with a title and is built
+# from the same seeded generator, so runs are comparable across machines.
+PROFILES = {
+    'prose-small': {'sections': 3, 'tables': 0, 'code_blocks': 0, 'images': 0},
+    'prose-large': {'sections': 150, 'tables': 0, 'code_blocks': 0, 'images': 0},
+    'tables': {'sections': 10, 'tables': 15, 'code_blocks': 0, 'images': 0},
+    'code': {'sections': 10, 'tables': 0, 'code_blocks': 40, 'images': 0},
+    'images': {'sections': 10, 'tables': 0, 'code_blocks': 0, 'images': 12},
+    'mixed-large': {'sections': 80, 'tables': 12, 'code_blocks': 30, 'images': 8},
+    # One long table, as converted from a CSV export
+    'table-large': {'sections': 1, 'tables': 1, 'code_blocks': 0, 'images': 0, 'table_rows': 500},
+}
+
+WORDS = (
+    'document converter markdown render layout table column value section '
+    'paragraph pipeline latency export archive preview heading figure result '
+    'stream worker cache process format style page report summary detail'
+).split()
+
+# 8x8 orange PNG, inlined so renders never touch the network or disk
+PNG_DATA_URI = (
+    'data:image/png;base64,'
+    'iVBORw0KGgoAAAANSUhEUgAAAAgAAAAICAIAAABLbSncAAAAEklEQVR4nGP4n82AFWEXHbQS'
+    'AJyVWoG3zT3LAAAAAElFTkSuQmCC'
+)
+
+CODE_SAMPLES = [
+    ('python', 'def render(items):\n    for index, item in enumerate(items):\n'
+               '        if item.ready:\n            yield index, item.value * 2\n'),
+    ('javascript', 'async function load(url) {\n  const response = await fetch(url);\n'
+                   '  return response.ok ? response.json() : null;\n}\n'),
+    ('', 'SELECT name, COUNT(*) AS total\nFROM documents\n'
+         'WHERE status = \'done\'\nGROUP BY name\nORDER BY total DESC;\n'),
+    ('', '#!/bin/sh\nset -e\nfor f in *.md; do\n  markforge "$f" --out build/\ndone\n'),
+]
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _paragraph(rng: random.Random) -> str:
+    sentences = [_sentence(rng, rng.randint(6, 18)) for _ in range(rng.randint(3, 6))]
+    # Sprinkle inline formatting the renderers have to handle
+    sentences[0] = f'**{sentences[0]}**'
+    if len(sentences) > 2:
+        sentences[2] = f'`{rng.choice(WORDS)}` {sentences[2]}'
+    return ' '.join(sentences)
+
+
+def _table(rng: random.Random, rows: int, columns: int) -> str:
+    header = '| ' + ' | '.join(rng.choice(WORDS).title() for _ in range(columns)) + ' |'
+    divider = '|' + '---|' * columns
+    body = [
+        '| ' + ' | '.join(str(rng.randint(0, 99999)) if c else rng.choice(WORDS)
+                          for c in range(columns)) + ' |'
+        for _ in range(rows)
+    ]
+    return '\n'.join([header, divider] + body)
+
+
+def _code_block(rng: random.Random) -> str:
+    lang, code = rng.choice(CODE_SAMPLES)
+    return f'```{lang}\n{code}```'
+
+
+def build_document(name: str, seed: int = 1) -> str:
+    """Return the Markdown text of a corpus document."""
+    shape = PROFILES[name]
+    rng = random.Random(f'{name}:{seed}')
+    sections = shape['sections']
+    extras = (['table'] * shape['tables'] + ['code'] * shape['code_blocks']
+              + ['image'] * shape['images'])
+    rng.shuffle(extras)
+
+    parts = [f'# {name.replace("-", " ").title()} Benchmark\n', _paragraph(rng)]
+    for index in range(sections):
+        parts.append(f'## Section {index + 1}: {_sentence(rng, 3)[:-1]}')
+        parts.append(_paragraph(rng))
+        if index % 4 == 3:
+            parts.append('\n'.join(f'- {_sentence(rng, 5)}' for _ in range(4)))
+        # Spread tables, code and images evenly over the sections
+        for _ in range(len(extras) // (sections - index)):
+            kind = extras.pop()
+            if kind == 'table':
+                rows = shape.get('table_rows') or rng.randint(8, 30)
+                parts.append(_table(rng, rows, rng.randint(3, 6)))
+            elif kind == 'code':
+                parts.append(_code_block(rng))
+            else:
+                parts.append(f'![Figure {index + 1}]({PNG_DATA_URI})')
+    return '\n\n'.join(parts) + '\n'
+
+
+def build_corpus(names=None, seed: int = 1) -> dict:
+    """Return {name: markdown_text} for the given profiles (default: all)."""
+    return {name: build_document(name, seed) for name in (names or PROFILES)}
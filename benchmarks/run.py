@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+MarkForge - Render pipeline benchmark
+Times the hot paths of server.py over the synthetic corpus:
+
+  markdown_html   convert_markdown_to_html
+  pdf_xhtml2pdf   generate_pdf_bytes, rendering in-process with xhtml2pdf
+  markitdown      MarkItDown conversion of an HTML rendering of the document
+
+Each (stage, document) case runs in a fresh process, so peak RSS is per
+case. The cold import time of server.py and of the backends it loads on
+first use is measured with -X importtime. Results are written as JSON and
+can be stored as a baseline that later runs are compared against.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --save-baseline
+    python benchmarks/run.py --compare --threshold 0.15
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    # Windows: peak RSS is not reported
+    HAS_RESOURCE = False
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(BENCH_DIR))
+
+from corpus import PROFILES, build_document  # noqa: E402
+
+STAGES = ('markdown_html', 'pdf_xhtml2pdf', 'markitdown')
+DEFAULT_OUTPUT = BENCH_DIR / 'results.json'
+DEFAULT_BASELINE = BENCH_DIR / 'baseline.json'
+# Metrics compared against the baseline, and whether higher is worse
+COMPARED_METRICS = {'p50_ms': True, 'p95_ms': True, 'peak_rss_mb': True}
+# Cold imports timed in fresh interpreters: the server's startup, then the
+# backends it imports on first use
+IMPORT_MODULES = ('server', 'xhtml2pdf.pisa', 'markitdown', 'playwright.sync_api')
+# "import time: <self us> | <cumulative us> | <indent><module>"
+IMPORT_TIME_RE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)$')
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Linear-interpolated percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def peak_rss_mb() -> float:
+    if not HAS_RESOURCE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _stage_callable(stage: str, markdown_text: str, workdir: str):
+    """Return a zero-argument callable running one stage, or None if unavailable."""
+    import server
+
+    if stage == 'markdown_html':
+        return lambda: server.convert_markdown_to_html(markdown_text)
+
+    if stage == 'pdf_xhtml2pdf':
+        if not server.HAS_XHTML2PDF:
+            return None
+        return lambda: server.generate_pdf_bytes(markdown_text)
+
+    if stage == 'markitdown':
+        import markdown
+        path = os.path.join(workdir, 'document.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<html><body>' + markdown.markdown(markdown_text, extensions=['tables', 'fenced_code'])
+                    + '</body></html>')
+        converter = server.get_md_converter()
+        return lambda: converter.convert(path)
+
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def run_case(stage: str, document: str, iterations: int, warmup: int) -> dict:
+    """Run one benchmark case; executed in its own process."""
+    markdown_text = build_document(document)
+    result = {
+        'stage': stage,
+        'document': document,
+        'input_bytes': len(markdown_text.encode('utf-8')),
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        func = _stage_callable(stage, markdown_text, workdir)
+        if func is None:
+            return {**result, 'skipped': 'backend not installed'}
+
+        for _ in range(warmup):
+            func()
+
+        timings = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - t0) * 1000)
+        elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        **result,
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'throughput_ops': round(iterations / elapsed, 2),
+        'throughput_mb_s': round(result['input_bytes'] * iterations / elapsed / 1e6, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _import_times(code: str) -> list:
+    """Run code under -X importtime; return (depth, module, cumulative ms) in order."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match:
+            entries.append(((len(match.group(2)) - 1) // 2, match.group(3), int(match.group(1)) / 1000))
+    return entries
+
+
+def measure_import(module: str, runs: int) -> dict:
+    """Best-of-runs cold import time of module and its slowest direct imports."""
+    startup = {name for _, name, _ in _import_times('pass') or []}
+    best = None
+    for _ in range(runs):
+        entries = _import_times(f'import {module}')
+        if entries is None:
+            return {'module': module, 'skipped': 'not importable'}
+        # Modules the interpreter imports at startup are listed too
+        entries = [entry for entry in entries if entry[1] not in startup]
+        total = sum(ms for depth, _, ms in entries if depth == 0)
+        if best is None or total < best[0]:
+            best = (total, entries)
+    total, entries = best
+    slowest = sorted((entry for entry in entries if entry[0] == 1), key=lambda entry: -entry[2])[:5]
+    return {
+        'module': module,
+        'import_ms': round(total, 1),
+        'slowest': [{'module': name, 'ms': round(ms, 1)} for _, name, ms in slowest],
+    }
+
+
+def format_import_row(result: dict) -> str:
+    name = f"{'import':<14} {result['module']:<20}"
+    if 'skipped' in result:
+        return f"{name} skipped: {result['skipped']}"
+    slowest = ', '.join(f"{entry['module']} {entry['ms']:.0f}" for entry in result['slowest'][:3])
+    return f"{name} {result['import_ms']:>9.1f} ms  ({slowest})"
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(stages, documents, iterations: int, warmup: int, import_runs: int) -> dict:
+    """Run every case in a fresh spawned process and collect the results."""
+    # Render in-process and keep benchmark state out of the shared directories
+    scratch = tempfile.mkdtemp(prefix='markforge-bench-')
+    os.environ['MARKFORGE_PDF_PROCESSES'] = '0'
+    # Backends load when a case first uses them, not in the background
+    os.environ['MARKFORGE_WARM_UP'] = '0'
+    os.environ.setdefault('MARKFORGE_JOB_DIR', os.path.join(scratch, 'jobs'))
+    os.environ.setdefault('MARKFORGE_DOC_CACHE_DIR', os.path.join(scratch, 'documents'))
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for stage in stages:
+        for document in documents:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_case, stage, document, iterations, warmup).result()
+            results.append(result)
+            print(format_row(result), flush=True)
+
+    imports = []
+    if import_runs > 0:
+        for module in IMPORT_MODULES:
+            imports.append(measure_import(module, import_runs))
+            print(format_import_row(imports[-1]), flush=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'iterations': iterations,
+            'warmup': warmup,
+        },
+        'results': results,
+        'imports': imports,
+    }
+
+
+def format_row(result: dict) -> str:
+    name = f"{result['stage']:<14} {result['document']:<12}"
+    if 'skipped' in result:
+        return f"{name} skipped: {result['skipped']}"
+    rss = result['peak_rss_mb']
+    return (f"{name} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+            f"p99 {result['p99_ms']:>9.2f} ms  {result['throughput_ops']:>8.2f} ops/s  "
+            f"rss {'n/a' if rss is None else f'{rss:.1f} MB'}")
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Return human-readable regressions of current against baseline."""
+    previous = {(r['stage'], r['document']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in current['results']:
+        before = previous.get((result['stage'], result['document']))
+        if before is None or 'skipped' in result or 'skipped' in before:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append(
+                    f"{result['stage']}/{result['document']} {metric}: "
+                    f"{old:g} -> {new:g} ({change:+.1%})"
+                )
+
+    previous_imports = {r['module']: r for r in baseline.get('imports', [])}
+    for result in current.get('imports', []):
+        old = previous_imports.get(result['module'], {}).get('import_ms')
+        new = result.get('import_ms')
+        if old and new is not None and (new - old) / old > threshold:
+            regressions.append(f"import {result['module']} import_ms: {old:g} -> {new:g} ({(new - old) / old:+.1%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the MarkForge render pipeline.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--documents', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--import-runs', type=int, default=3,
+                        help='cold imports timed per module, best counts (0 skips)')
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT,
+                        help='where to write the JSON results')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='also store these results as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare against the baseline and exit 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='relative change counted as a regression (default 0.15)')
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.stages, args.documents, max(1, args.iterations), args.warmup,
+                             args.import_runs)
+
+    args.output.write_text(json.dumps(current, indent=2))
+    print(f"\nResults written to {args.output}")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(current, indent=2))
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        if not args.baseline.exists():
+            print(f"No baseline at {args.baseline}; run with --save-baseline first.")
+            return 1
+        regressions = compare(current, json.loads(args.baseline.read_text()), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+MarkForge - Reproducible PDF test
+Renders corpus documents to PDF in reproducible mode several times in this
+process and in fresh worker processes, and asserts that every render of a
+document is byte-identical. Also asserts that normalize_pdf pins the dates
+and IDs of a Chromium-style PDF without moving any bytes.
+
+    python -m pytest benchmarks/test_reproducible.py
+    python benchmarks/test_reproducible.py --documents code mixed-large --processes 4
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Before anything imports reproducible; spawned workers inherit it
+os.environ['MARKFORGE_PDF_REPRODUCIBLE'] = '1'
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(BENCH_DIR))
+
+from corpus import PROFILES, build_document  # noqa: E402
+
+DEFAULT_DOCUMENTS = ('prose-small', 'tables', 'code', 'images')
+
+CHROMIUM_STYLE_PDF = (
+    b'%PDF-1.4\n1 0 obj\n<</Creator (Chromium) /Producer (Skia/PDF m120)'
+    b' /CreationDate (D:{date}+02\'00\') /ModDate (D:{date}+02\'00\')>>\nendobj\n'
+    b'2 0 obj\n<</Type /Metadata /Subtype /XML /Length 200>>\nstream\n'
+    b'<xmp:CreateDate>{xmp}+02:00</xmp:CreateDate>'
+    b'<xmpMM:DocumentID>uuid:{uuid}</xmpMM:DocumentID>\nendstream\nendobj\n'
+    b'trailer\n<</Size 3 /Root 1 0 R /Info 1 0 R /ID [<{id}> <{id}>]>>\n%%EOF\n'
+)
+
+
+def render_hashes(names: list, repeat: int) -> dict:
+    """Render each document repeat times; return {name: [sha256, ...]}."""
+    import markforge
+    return {
+        name: [hashlib.sha256(markforge.convert_text(build_document(name))).hexdigest()
+               for _ in range(repeat)]
+        for name in names
+    }
+
+
+def check_normalize() -> list:
+    """Normalize two Chromium-style PDFs that differ only in dates and IDs."""
+    from reproducible import normalize_pdf
+
+    def fake(date, xmp, uuid, doc_id):
+        return (CHROMIUM_STYLE_PDF.replace(b'{date}', date).replace(b'{xmp}', xmp)
+                .replace(b'{uuid}', uuid).replace(b'{id}', doc_id))
+
+    first = fake(b'20260101093000', b'2026-01-01T09:30:00',
+                 b'0a1b2c3d-0000-4000-8000-1234567890ab', b'00112233445566778899aabbccddeeff')
+    second = fake(b'20261017181512', b'2026-10-17T18:15:12',
+                  b'ffeeddcc-1111-4111-9111-ba0987654321', b'ffeeddccbbaa99887766554433221100')
+    problems = []
+    if normalize_pdf(first) != normalize_pdf(second):
+        problems.append('normalize_pdf: differing dates and IDs survive normalization')
+    if len(normalize_pdf(first)) != len(first):
+        problems.append('normalize_pdf: output length changed, xref offsets would break')
+    return problems
+
+
+def collect_runs(names: list, repeat: int, processes: int) -> list:
+    """Render in this process and in fresh ones; return [(label, hashes), ...]."""
+    import markforge
+    markforge._configure_workers()
+
+    runs = [('main', render_hashes(names, repeat))]
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        futures = [pool.submit(render_hashes, names, repeat) for _ in range(processes)]
+        runs.extend((f'worker {i + 1}', future.result()) for i, future in enumerate(futures))
+    return runs
+
+
+def mismatches(names: list, runs: list) -> list:
+    """Describe every document whose renders are not all identical."""
+    problems = []
+    for name in names:
+        if len({digest for _, result in runs for digest in result[name]}) != 1:
+            for label, result in runs:
+                problems.append(f"{name}: {label}: {', '.join(d[:16] for d in result[name])}")
+    return problems
+
+
+def test_normalize_pdf():
+    assert check_normalize() == []
+
+
+def test_renders_are_byte_identical():
+    runs = collect_runs(list(DEFAULT_DOCUMENTS), repeat=2, processes=2)
+    assert mismatches(list(DEFAULT_DOCUMENTS), runs) == []
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--documents', nargs='+', choices=sorted(PROFILES), default=list(DEFAULT_DOCUMENTS))
+    parser.add_argument('--repeat', type=int, default=2, help='Renders per document per process')
+    parser.add_argument('--processes', type=int, default=2, help='Fresh worker processes')
+    args = parser.parse_args()
+
+    runs = collect_runs(args.documents, args.repeat, args.processes)
+    for name in args.documents:
+        hashes = {digest for _, result in runs for digest in result[name]}
+        status = 'ok' if len(hashes) == 1 else 'MISMATCH'
+        print(f"{name:<14} {status:<9} {sorted(hashes)[0][:16]}"
+              f"  ({len(runs) * args.repeat} renders in {len(runs)} processes)")
+    problems = check_normalize() + mismatches(args.documents, runs)
+
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
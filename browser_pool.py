@@ -0,0 +1,248 @@
+"""
+MarkForge - Persistent Playwright browser pool
+Long-lived Chromium instances for the PDF fallback path. Playwright's sync
+API is bound to the thread that started it, so every browser lives on its
+own worker thread and requests are handed over through a job queue. The
+number of worker threads caps the number of concurrently rendering pages.
+"""
+
+import atexit
+import os
+import queue
+import threading
+
+from playwright.sync_api import sync_playwright
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+DEFAULT_POOL_SIZE = int(os.environ.get('MARKFORGE_BROWSER_POOL_SIZE', 1))
+DEFAULT_MAX_RENDERS = int(os.environ.get('MARKFORGE_BROWSER_MAX_RENDERS', 100))
+DEFAULT_MAX_MEMORY_MB = int(os.environ.get('MARKFORGE_BROWSER_MAX_MEMORY_MB', 768))
+DEFAULT_RENDER_TIMEOUT = float(os.environ.get('MARKFORGE_BROWSER_RENDER_TIMEOUT', 60))
+
+
+class _RenderJob:
+    """A single HTML to PDF request handed to a browser worker."""
+
+    def __init__(self, html: str, pdf_options: dict):
+        self.html = html
+        self.pdf_options = pdf_options
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        # Set when the caller gave up waiting; a worker skips it if not yet started
+        self.cancelled = False
+
+
+class _BrowserWorker(threading.Thread):
+    """Owns one Playwright driver, browser, context and page."""
+
+    def __init__(self, pool, index: int):
+        super().__init__(name=f'markforge-browser-{index}', daemon=True)
+        self.pool = pool
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._page = None
+        self.renders = 0
+
+    def _ensure_page(self):
+        """Health-check the browser and (re)create it, the context and the page."""
+        if self._browser is not None and not self._browser.is_connected():
+            print("Browser disconnected, relaunching")
+            self._close_browser()
+            self.pool.crashes += 1
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        if self._browser is None:
+            self._browser = self._playwright.chromium.launch()
+            self.renders = 0
+            self.pool.launches += 1
+        if self._context is None:
+            self._context = self._browser.new_context()
+        if self._page is None or self._page.is_closed():
+            self._page = self._context.new_page()
+            self._page.set_default_timeout(self.pool.render_timeout * 1000)
+        return self._page
+
+    def _discard_page(self):
+        """Drop the page and context so a bad document cannot affect later renders."""
+        for closable in (self._page, self._context):
+            if closable is None:
+                continue
+            try:
+                closable.close()
+            except Exception:
+                pass
+        self._page = None
+        self._context = None
+
+    def _close_browser(self):
+        self._discard_page()
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except Exception:
+                pass
+        self._browser = None
+
+    def _shutdown(self):
+        self._close_browser()
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception:
+                pass
+        self._playwright = None
+
+    def _needs_recycle(self) -> bool:
+        if self.renders >= self.pool.max_renders:
+            return True
+        return self.pool.browser_memory_mb() > self.pool.max_memory_mb * self.pool.size
+
+    def _render(self, job: _RenderJob) -> bytes:
+        page = self._ensure_page()
+        page.set_content(job.html, wait_until='networkidle')
+        return page.pdf(**job.pdf_options)
+
+    def run(self):
+        while True:
+            job = self.pool.jobs.get()
+            if job is None:
+                break
+            if job.cancelled:
+                job.done.set()
+                continue
+            try:
+                job.result = self._render(job)
+            except Exception as e:
+                job.error = e
+                self.pool.failures += 1
+                self._discard_page()
+                if self._browser is not None and not self._browser.is_connected():
+                    self._close_browser()
+                    self.pool.crashes += 1
+            finally:
+                job.done.set()
+
+            self.renders += 1
+            self.pool.renders += 1
+            if self._browser is not None and self._needs_recycle():
+                self._close_browser()
+                self.pool.recycles += 1
+        self._shutdown()
+
+
+class BrowserPool:
+    """Pool of persistent Chromium browsers rendering HTML to PDF."""
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE,
+                 max_renders: int = DEFAULT_MAX_RENDERS,
+                 max_memory_mb: int = DEFAULT_MAX_MEMORY_MB,
+                 render_timeout: float = DEFAULT_RENDER_TIMEOUT):
+        self.size = max(1, size)
+        self.max_renders = max_renders
+        self.max_memory_mb = max_memory_mb
+        self.render_timeout = render_timeout
+        self.jobs = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.failures = 0
+        self.crashes = 0
+        self.launches = 0
+        self.recycles = 0
+        self.timeouts = 0
+
+    def _start(self):
+        with self._lock:
+            if self._workers:
+                return
+            for index in range(self.size):
+                worker = _BrowserWorker(self, index)
+                worker.start()
+                self._workers.append(worker)
+
+    def render_pdf(self, html: str, pdf_options: dict) -> bytes:
+        """Render an HTML document to PDF on a pooled browser."""
+        self._start()
+        job = _RenderJob(html, pdf_options)
+        self.jobs.put(job)
+        # Allow for time spent queued behind other renders
+        if not job.done.wait(self.render_timeout * 2):
+            job.cancelled = True
+            self.timeouts += 1
+            raise TimeoutError("Browser PDF render timed out")
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    @staticmethod
+    def browser_memory_mb() -> float:
+        """Resident memory of the Playwright drivers and the Chromium they run.
+
+        Only the driver processes (node ... run-driver) and their descendants
+        count, not other children of the worker such as the PDF process pool.
+        """
+        if not HAS_PSUTIL:
+            return 0.0
+        total = 0
+        try:
+            children = psutil.Process().children()
+        except psutil.Error:
+            return 0.0
+        for child in children:
+            try:
+                if 'run-driver' not in child.cmdline():
+                    continue
+                processes = [child] + child.children(recursive=True)
+            except psutil.Error:
+                continue
+            for process in processes:
+                try:
+                    total += process.memory_info().rss
+                except psutil.Error:
+                    continue
+        return total / (1024 * 1024)
+
+    def close(self):
+        """Stop all workers and their browsers."""
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+        for _ in workers:
+            self.jobs.put(None)
+        for worker in workers:
+            worker.join(timeout=10)
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size,
+            'queued': self.jobs.qsize(),
+            'renders': self.renders,
+            'failures': self.failures,
+            'crashes': self.crashes,
+            'launches': self.launches,
+            'recycles': self.recycles,
+            'timeouts': self.timeouts,
+            'memory_mb': round(self.browser_memory_mb(), 1),
+        }
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Return the per-worker browser pool, creating it on first use."""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = BrowserPool()
+                atexit.register(_default_pool.close)
+    return _default_pool
@@ -0,0 +1,133 @@
+"""
+MarkForge - Incremental build manifest
+Records, for every output a directory conversion produced, the content hash
+and stat of its source, the pipeline version it was rendered with, and the
+stat of the output. A later build re-renders only outputs whose source
+content or pipeline changed. The manifest is a SQLite database in WAL mode,
+so it persists across runs and concurrent builds can share it.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    output TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime_ns INTEGER NOT NULL,
+    pipeline TEXT NOT NULL,
+    output_size INTEGER NOT NULL,
+    output_mtime_ns INTEGER NOT NULL,
+    built REAL NOT NULL
+)
+"""
+
+MANIFEST_NAME = '.markforge-manifest.sqlite3'
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    """SQLite manifest of built outputs, keyed by absolute output path.
+
+    Sources are compared by size and mtime first and only hashed when those
+    differ, so a no-op rebuild of a large tree costs one stat per file.
+    Outputs are also compared by stat: an output changed or replaced by
+    anything other than the build that recorded it is rebuilt.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection, committing on success."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(output: str) -> str:
+        return os.path.realpath(output)
+
+    def is_current(self, source: str, output: str, pipeline: str) -> bool:
+        """True if output was built from source's current content by this pipeline."""
+        try:
+            source_stat = os.stat(source)
+            output_stat = os.stat(output)
+        except OSError:
+            return False
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT * FROM outputs WHERE output = ?', (self._key(output),)
+            ).fetchone()
+        if row is None or row['pipeline'] != pipeline:
+            return False
+        if (row['output_size'], row['output_mtime_ns']) != (output_stat.st_size, output_stat.st_mtime_ns):
+            return False
+        if (row['source_size'], row['source_mtime_ns']) == (source_stat.st_size, source_stat.st_mtime_ns):
+            return True
+
+        # Touched, checked out again or copied: unchanged if the content is
+        try:
+            source_hash = file_digest(source)
+        except OSError:
+            return False
+        if source_hash != row['source_hash']:
+            return False
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE outputs SET source_size = ?, source_mtime_ns = ? '
+                'WHERE output = ? AND source_hash = ?',
+                (source_stat.st_size, source_stat.st_mtime_ns, self._key(output), source_hash)
+            )
+        return True
+
+    def record(self, source: str, output: str, pipeline: str, source_hash: str,
+               source_stat: os.stat_result, output_stat: os.stat_result) -> None:
+        """Record a finished build.
+
+        source_stat must be taken before the source was read and
+        output_stat right after the output was written, so a source edited
+        mid-build, or an output overwritten by a concurrent build, makes the
+        entry look stale rather than current.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self._key(output), os.path.realpath(source), source_hash,
+                 source_stat.st_size, source_stat.st_mtime_ns, pipeline,
+                 output_stat.st_size, output_stat.st_mtime_ns, time.time())
+            )
+
+    def forget(self, output: str) -> None:
+        with self._connect() as conn:
+            conn.execute('DELETE FROM outputs WHERE output = ?', (self._key(output),))
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM outputs').fetchone()[0]
+        return {'path': self.path, 'entries': entries}
@@ -62,6 +62,7 @@ def build():
         'webview',
         'flask',
         'markdown',
+        'code_highlight',  # loaded by name as a Markdown extension
         'markitdown',
         'PIL',
         'PIL.Image',
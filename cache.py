@@ -0,0 +1,313 @@
+"""
+MarkForge - Content-addressed caches
+In-memory LRU cache with a byte budget and an optional on-disk store
+shared between gunicorn workers.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    # Windows desktop builds: eviction still works, just without a cross-process lock
+    HAS_FCNTL = False
+
+
+def content_key(*parts) -> str:
+    """Return a SHA-256 hex digest over the given text/bytes parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def stream_digest(stream, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a seekable binary stream's content, rewinding it afterwards."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def config_fingerprint(config) -> str:
+    """Stable fingerprint of a JSON-serialisable configuration."""
+    return content_key(json.dumps(config, sort_keys=True, default=str))[:16]
+
+
+class LRUByteCache:
+    """Thread-safe LRU cache evicting entries once a byte budget is exceeded."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(key, value) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+    def get(self, key):
+        """Return the cached value or None, marking it most recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value) -> None:
+        """Store a value, evicting least recently used entries as needed."""
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class DiskCache:
+    """Content-addressed file store with size-bounded LRU eviction.
+
+    Entries are written atomically (temp file + os.replace), so several
+    processes can share one directory. Access time is tracked through the
+    file mtime and the oldest files are removed once max_bytes is exceeded.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path_for(self, key: str) -> str:
+        """Return the on-disk path of an entry (which may not exist)."""
+        return os.path.join(self.directory, key[:2], key)
+
+    def _touch(self, path: str) -> None:
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self.path_for(key))
+
+    def get(self, key: str):
+        """Return the stored bytes or None."""
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        self._touch(path)
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def open(self, key: str):
+        """Return (binary file, size) for a stored entry, or None.
+
+        The caller closes the file. An entry evicted while open stays
+        readable through the open file.
+        """
+        path = self.path_for(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        self._touch(path)
+        with self._lock:
+            self.hits += 1
+        return f, os.fstat(f.fileno()).st_size
+
+    def set(self, key: str, data: bytes) -> None:
+        """Atomically store bytes under key."""
+        self._store(key, lambda f: f.write(data))
+        self._account(len(data))
+
+    def set_file(self, key: str, source) -> None:
+        """Atomically store the rest of a binary file object under key."""
+        start = source.tell()
+        self._store(key, lambda f: shutil.copyfileobj(source, f))
+        self._account(source.tell() - start)
+
+    def _store(self, key: str, write) -> None:
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _account(self, added: int) -> None:
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._scan_size()
+            else:
+                self._approx_bytes += added
+            over_budget = self._approx_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _entries(self):
+        """Yield (mtime, size, path) for every stored entry."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self) -> None:
+        """Remove least recently used entries until under 90% of the budget."""
+        lock_file = None
+        if HAS_FCNTL:
+            lock_file = open(os.path.join(self.directory, '.evict.lock'), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is already evicting
+                lock_file.close()
+                return
+        try:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            evicted = 0
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+            with self._lock:
+                self._approx_bytes = total
+                self.evictions += evicted
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'directory': self.directory,
+                'bytes': self._approx_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class RenderCache:
+    """Two-tier text cache: per-process LRU backed by an optional shared DiskCache."""
+
+    def __init__(self, max_bytes: int, shared_dir: str = None,
+                 shared_max_bytes: int = None):
+        self.memory = LRUByteCache(max_bytes)
+        self.shared = None
+        if shared_dir:
+            self.shared = DiskCache(shared_dir, shared_max_bytes or max_bytes * 4)
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None or self.shared is None:
+            return value
+        data = self.shared.get(key)
+        if data is None:
+            return None
+        value = data.decode('utf-8')
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value.encode('utf-8'))
+            except OSError as e:
+                print(f"Shared cache write failed: {e}")
+
+    def stats(self) -> dict:
+        stats = {'memory': self.memory.stats()}
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
+
+
+def default_cache_dir(name: str) -> str:
+    """Return a per-host cache directory under the system temp dir."""
+    return os.path.join(tempfile.gettempdir(), 'markforge', name)
@@ -0,0 +1,331 @@
+"""
+MarkForge - Cached Pygments highlighting for code blocks
+Drop-in replacement for the codehilite extension. Lexers and formatters are
+built once and reused, highlighted blocks are memoized by content, and
+language guessing for unlabeled or unrecognised blocks is bounded by block
+size and a per-document time budget.
+"""
+
+import html
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from markdown.extensions.attr_list import get_attrs_and_remainder
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension, parse_hl_lines
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markdown.treeprocessors import Treeprocessor
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name, guess_lexer
+from pygments.util import ClassNotFound
+
+from cache import LRUByteCache, content_key
+from metrics import add_time
+
+CACHE_BYTES = int(os.environ.get('MARKFORGE_HIGHLIGHT_CACHE_BYTES', 16 * 1024 * 1024))
+# Unlabeled blocks larger than this are not guessed and render as plain text
+GUESS_MAX_BYTES = int(os.environ.get('MARKFORGE_HIGHLIGHT_GUESS_MAX_BYTES', 8 * 1024))
+# Total time a single render may spend guessing languages
+GUESS_BUDGET_MS = float(os.environ.get('MARKFORGE_HIGHLIGHT_GUESS_BUDGET_MS', 50))
+# Blocks guessed per render when the result must not depend on timing
+# (reproducible PDFs); later unlabeled blocks render as plain text
+GUESS_MAX_BLOCKS = int(os.environ.get('MARKFORGE_HIGHLIGHT_GUESS_MAX_BLOCKS', 20))
+# hl_lines come from the documents, so only this many formatters are kept
+MAX_FORMATTERS = 256
+
+# RenderStatus of the render being tracked with track_degraded()
+_status = ContextVar('markforge_highlight_status', default=None)
+
+
+class RenderStatus:
+    """degraded is set once a block falls back to plain text on an exhausted budget."""
+
+    __slots__ = ('degraded',)
+
+    def __init__(self):
+        self.degraded = False
+
+
+@contextmanager
+def track_degraded():
+    """Yield a RenderStatus for the highlighting done in this context.
+
+    Output produced while the guessing budget was exhausted depends on
+    timing, so callers must not cache it when status.degraded is set.
+    """
+    status = RenderStatus()
+    token = _status.set(status)
+    try:
+        yield status
+    finally:
+        _status.reset(token)
+
+
+class CodeHighlighter:
+    """Thread-safe Pygments highlighter with cached lexers, formatters and output."""
+
+    def __init__(self, cache_bytes: int = CACHE_BYTES, guess_max_bytes: int = GUESS_MAX_BYTES):
+        self.guess_max_bytes = guess_max_bytes
+        self.cache = LRUByteCache(cache_bytes)
+        self._lexers = {}
+        self._formatters = {}
+        self._lock = threading.Lock()
+        self.guesses = 0
+        self.guess_skipped = 0
+        self.guess_timeouts = 0
+
+    def lexer(self, lang: str):
+        """Return the shared lexer for a language name or alias, or None if unknown."""
+        lang = lang.lower()
+        try:
+            return self._lexers[lang]
+        except KeyError:
+            pass
+        try:
+            lexer = get_lexer_by_name(lang)
+        except ClassNotFound:
+            lexer = None
+        with self._lock:
+            return self._lexers.setdefault(lang, lexer)
+
+    def formatter(self, css_class: str, linenos=False, hl_lines: tuple = ()) -> HtmlFormatter:
+        """Return the shared HTML formatter for a wrapper class and block options."""
+        key = (css_class, linenos, hl_lines)
+        try:
+            return self._formatters[key]
+        except KeyError:
+            pass
+        # Same options CodeHilite passes to Pygments
+        formatter = HtmlFormatter(cssclass=css_class, linenos=linenos, hl_lines=list(hl_lines), wrapcode=True)
+        with self._lock:
+            if len(self._formatters) >= MAX_FORMATTERS:
+                return formatter
+            return self._formatters.setdefault(key, formatter)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _guess(self, code: str, deadline: float):
+        """Guess a lexer within the size limit and time budget, or None."""
+        if len(code) > self.guess_max_bytes:
+            self._count('guess_skipped')
+            return None, True
+        if time.monotonic() >= deadline:
+            self._count('guess_timeouts')
+            return None, False
+        self._count('guesses')
+        try:
+            return guess_lexer(code), True
+        except ClassNotFound:
+            return None, True
+
+    def highlight(self, code: str, lang: str = None, guess: bool = False,
+                  css_class: str = 'codehilite', deadline: float = None,
+                  linenos=False, hl_lines=()) -> str:
+        """Highlight code as HTML.
+
+        If guess is set, the language of blocks that are unlabeled or whose
+        label Pygments does not know is guessed, as CodeHilite does.
+        linenos and hl_lines are passed to the Pygments formatter.
+        """
+        lexer = self.lexer(lang) if lang else None
+        guess = guess and lexer is None
+        hl_lines = tuple(hl_lines or ())
+        key = content_key(lang or '', 'guess' if guess else '', css_class,
+                          str(linenos), ' '.join(map(str, hl_lines)), code)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        cacheable = True
+        if guess:
+            lexer, cacheable = self._guess(code, deadline if deadline is not None else float('inf'))
+        if lexer is None:
+            lexer = self.lexer('text')
+
+        result = highlight(code, lexer, self.formatter(css_class, linenos, hl_lines))
+        # Plain-text fallbacks from an exhausted budget are not remembered,
+        # here or in the caches of whatever render this block is part of
+        if cacheable:
+            self.cache.set(key, result)
+        else:
+            status = _status.get()
+            if status is not None:
+                status.degraded = True
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {
+                'lexers': len(self._lexers),
+                'formatters': len(self._formatters),
+                'guesses': self.guesses,
+                'guess_skipped': self.guess_skipped,
+                'guess_timeouts': self.guess_timeouts,
+            }
+        return {**counters, 'cache': self.cache.stats()}
+
+
+_default_highlighter = None
+_default_highlighter_lock = threading.Lock()
+
+
+def get_highlighter() -> CodeHighlighter:
+    """Return the process-wide highlighter, creating it on first use."""
+    global _default_highlighter
+    if _default_highlighter is None:
+        with _default_highlighter_lock:
+            if _default_highlighter is None:
+                _default_highlighter = CodeHighlighter()
+    return _default_highlighter
+
+
+class HighlightFencedPreprocessor(FencedBlockPreprocessor):
+    """fenced_code's preprocessor, highlighting blocks through CodeHighlighter.
+
+    Parses fences and their options exactly like fenced_code, so hl_lines
+    and linenums reach the formatter, then stashes the highlighted block.
+    """
+
+    def __init__(self, md, config, extension):
+        super().__init__(md, config)
+        self.extension = extension
+
+    def run(self, lines):
+        self.extension.start_render()
+        text = '\n'.join(lines)
+        index = 0
+        while True:
+            m = self.FENCED_BLOCK_RE.search(text, index)
+            if m is None:
+                break
+            lang, id, classes, config = None, '', [], {}
+            if m.group('attrs'):
+                attrs, remainder = get_attrs_and_remainder(m.group('attrs'))
+                if remainder:
+                    # Unbalanced braces are not a fence; skip past them
+                    index = m.end('attrs')
+                    continue
+                id, classes, config = self.handle_attrs(attrs)
+                if classes:
+                    lang = classes.pop(0)
+            else:
+                lang = m.group('lang') or None
+                if m.group('hl_lines'):
+                    config['hl_lines'] = parse_hl_lines(m.group('hl_lines'))
+
+            if config.get('use_pygments', True):
+                code = self.extension.highlight_block(m.group('code'), lang, classes, config)
+            else:
+                id_attr = f' id="{html.escape(id)}"' if id else ''
+                class_attr = f' class="{html.escape(" ".join(classes))}"' if classes else ''
+                lang_attr = f' class="language-{html.escape(lang)}"' if lang else ''
+                code = f'<pre{id_attr}{class_attr}><code{lang_attr}>{self._escape(m.group("code"))}</code></pre>'
+
+            placeholder = self.md.htmlStash.store(code)
+            text = f'{text[:m.start()]}\n{placeholder}\n{text[m.end():]}'
+            index = m.start() + 1 + len(placeholder)
+        return text.split('\n')
+
+
+class HighlightTreeprocessor(Treeprocessor):
+    """Highlight indented code blocks, honouring CodeHilite's :::lang headers."""
+
+    def __init__(self, md, extension):
+        super().__init__(md)
+        self.extension = extension
+
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code' and block[0].text is not None:
+                code = CodeHilite(
+                    html.unescape(block[0].text),
+                    use_pygments=False,
+                    linenums=self.extension.getConfig('linenums'),
+                    tab_length=self.md.tab_length,
+                )
+                # Only for the :::lang header, which sets lang, hl_lines and linenos
+                code.hilite()
+                placeholder = self.md.htmlStash.store(self.extension.highlight_block(
+                    code.src, code.lang, [],
+                    {'hl_lines': code.options.get('hl_lines'), 'linenums': code.options['linenos']},
+                ))
+                # Same trick as codehilite: the paragraph is replaced by the stash
+                block.clear()
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class HighlightExtension(CodeHiliteExtension):
+    """codehilite with cached Pygments objects and a per-render guess switch.
+
+    Fenced blocks are parsed by HighlightFencedPreprocessor, which replaces
+    fenced_code's preprocessor, so load this extension after fenced_code.
+    Set md.guess_lang to override the configured guess_lang for one render,
+    md.guess_budget_ms to override the guessing budget, and
+    md.guess_max_blocks to also cap how many blocks are guessed.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.config['guess_budget_ms'] = [GUESS_BUDGET_MS, 'Time budget for language guessing per render.']
+        self.setConfig('use_pygments', False)
+        self.highlighter = get_highlighter()
+        self.md = None
+        self.deadline = float('inf')
+        self.guesses_left = None
+
+    def extendMarkdown(self, md):
+        self.md = md
+        if 'fenced_code_block' in md.preprocessors:
+            fenced_config = md.preprocessors['fenced_code_block'].config
+            md.preprocessors.register(
+                HighlightFencedPreprocessor(md, fenced_config, self), 'fenced_code_block', 25
+            )
+        md.treeprocessors.register(HighlightTreeprocessor(md, self), 'hilite', 30)
+        md.registerExtension(self)
+
+    def start_render(self) -> None:
+        budget_ms = getattr(self.md, 'guess_budget_ms', None)
+        if budget_ms is None:
+            budget_ms = self.getConfig('guess_budget_ms')
+        self.deadline = time.monotonic() + budget_ms / 1000
+        self.guesses_left = getattr(self.md, 'guess_max_blocks', None)
+
+    def guess_lang(self) -> bool:
+        override = getattr(self.md, 'guess_lang', None)
+        return self.getConfig('guess_lang') if override is None else override
+
+    def highlight_block(self, code: str, lang: str, classes: list, options: dict) -> str:
+        """Highlight one code block with its own hl_lines and linenums options."""
+        start = time.perf_counter()
+        linenos = options.get('linenums')
+        if linenos is None:
+            linenos = self.getConfig('linenums')
+        guess = options.get('guess_lang', self.guess_lang())
+        if guess and self.guesses_left is not None and (not lang or self.highlighter.lexer(lang) is None):
+            # Counted whether or not the guess is cached, so only the
+            # document decides which blocks are guessed
+            if self.guesses_left <= 0:
+                guess = False
+            else:
+                self.guesses_left -= 1
+        highlighted = self.highlighter.highlight(
+            code.strip('\n'),
+            lang=lang,
+            guess=guess,
+            css_class=' '.join(classes + [self.getConfig('css_class')]),
+            deadline=self.deadline,
+            linenos=bool(linenos),
+            hl_lines=options.get('hl_lines') or (),
+        )
+        add_time('highlight', time.perf_counter() - start)
+        return highlighted
+
+
+def makeExtension(**kwargs):
+    return HighlightExtension(**kwargs)
@@ -0,0 +1,87 @@
+"""
+MarkForge - Incremental document to Markdown output
+Produces Markdown section by section (per page, sheet or slide) so large
+documents can be streamed to the editor as server-sent events.
+"""
+
+import json
+import re
+
+# Section boundaries in MarkItDown output, by file extension
+SECTION_PATTERNS = {
+    '.xlsx': re.compile(r'^## (.+)$', re.MULTILINE),
+    '.xls': re.compile(r'^## (.+)$', re.MULTILINE),
+    '.pptx': re.compile(r'^<!-- Slide number: (\d+) -->$', re.MULTILINE),
+}
+
+SECTION_LABELS = {
+    '.xlsx': 'Sheet {}',
+    '.xls': 'Sheet {}',
+    '.pptx': 'Slide {}',
+}
+
+# Documents without natural sections are sent in chunks of about this size
+CHUNK_CHARS = 64 * 1024
+
+# PDF text is kept as its pages, each followed by a form feed like
+# pdfminer's own extract_text output, so the pages can be split apart again
+PAGE_BREAK = '\f'
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def iter_pdf_pages(stream):
+    """Yield (label, markdown) per page using pdfminer's layout analysis."""
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+
+    for page_number, layout in enumerate(extract_pages(stream), 1):
+        text = ''.join(
+            element.get_text() for element in layout
+            if isinstance(element, LTTextContainer)
+        )
+        yield f'Page {page_number}', text.strip()
+
+
+def join_pages(pages) -> str:
+    """Join page texts so split_sections(..., '.pdf') yields them again."""
+    return ''.join(text + PAGE_BREAK for text in pages)
+
+
+def _chunks(markdown_text: str):
+    """Split text at paragraph boundaries into pieces of about CHUNK_CHARS."""
+    start = 0
+    while start < len(markdown_text):
+        end = start + CHUNK_CHARS
+        if end < len(markdown_text):
+            boundary = markdown_text.rfind('\n\n', start, end)
+            if boundary > start:
+                end = boundary + 2
+        yield markdown_text[start:end]
+        start = end
+
+
+def split_sections(markdown_text: str, extension: str):
+    """Yield (label, markdown) sections of a converted document."""
+    if extension == '.pdf' and markdown_text.endswith(PAGE_BREAK):
+        for page_number, text in enumerate(markdown_text.split(PAGE_BREAK)[:-1], 1):
+            yield f'Page {page_number}', text
+        return
+
+    pattern = SECTION_PATTERNS.get(extension)
+    matches = list(pattern.finditer(markdown_text)) if pattern else []
+    if not matches:
+        for index, chunk in enumerate(_chunks(markdown_text), 1):
+            yield f'Part {index}', chunk
+        return
+
+    preamble = markdown_text[:matches[0].start()].strip()
+    if preamble:
+        yield 'Document', preamble
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown_text)
+        label = SECTION_LABELS[extension].format(match.group(1))
+        yield label, markdown_text[match.start():end].strip()
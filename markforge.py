@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+MarkForge - Command-line batch converter
+Converts Markdown files to PDF or HTML with the same pipeline as the server,
+without going through HTTP. Accepts files, directories, glob patterns and
+stdin, and converts in parallel across a process pool. Outputs whose
+source content and rendering pipeline are unchanged since the last build
+are skipped (build_cache.py); with --no-manifest, like make, outputs newer
+than their source are.
+
+    python markforge.py docs/ -o build/pdf
+    python markforge.py 'docs/**/*.md' --format html -j 8
+    cat notes.md | python markforge.py - -o notes.pdf
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import glob
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import connection
+
+from build_cache import MANIFEST_NAME, BuildManifest
+from cache import config_fingerprint, default_cache_dir
+from watcher import RenderWorker, make_watcher
+
+MARKDOWN_SUFFIXES = ('.md', '.markdown', '.mdown', '.mkd')
+FORMATS = ('pdf', 'html')
+GLOB_CHARS = '*?['
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+_server = None
+
+
+def _load_server():
+    """Import the conversion pipeline once per process."""
+    global _server
+    if _server is None:
+        # Conversions import what they need; warming up MarkItDown only competes
+        os.environ.setdefault('MARKFORGE_WARM_UP', '0')
+        import server
+        _server = server
+    return _server
+
+
+def convert_text(markdown_text: str, fmt: str = 'pdf', page_size: str = 'A4', title: str = '') -> bytes:
+    """Convert Markdown text to PDF or standalone HTML bytes."""
+    server = _load_server()
+    if fmt == 'pdf':
+        return server.generate_pdf_bytes(markdown_text, page_size)
+    body = server.convert_markdown_to_html(markdown_text)
+    return HTML_TEMPLATE.format(title=title, body=body).encode('utf-8')
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write a file so readers never see it half-written."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def pipeline_version(fmt: str, page_size: str) -> str:
+    """Fingerprint of everything besides the source that shapes an output.
+
+    Covers the Markdown renderer configuration, the stylesheet or HTML
+    template, the page size and the PDF library versions, so changing any
+    of them rebuilds every output.
+    """
+    server = _load_server()
+    config = [fmt, server.renderer_pool.fingerprint]
+    if fmt == 'pdf':
+        config += [server.PDF_PIPELINE_VERSION, page_size]
+    else:
+        config.append(HTML_TEMPLATE)
+    return config_fingerprint(config)
+
+
+def convert_file(source: str, output: str, fmt: str, page_size: str) -> dict:
+    """Convert one file; returns a result dict with 'error' set on failure."""
+    start = time.perf_counter()
+    result = {'source': source, 'output': output, 'error': None}
+    try:
+        # Stat before reading: an edit made during the build leaves the
+        # recorded stat stale, never the recorded hash
+        result['source_stat'] = os.stat(source)
+        with open(source, 'rb') as f:
+            data = f.read()
+        result['source_hash'] = hashlib.sha256(data).hexdigest()
+        title = os.path.splitext(os.path.basename(source))[0]
+        write_atomic(output, convert_text(data.decode('utf-8'), fmt, page_size, title))
+        result['output_stat'] = os.stat(output)
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def _glob_root(pattern: str) -> str:
+    """The directory part of a pattern before its first wildcard."""
+    parts = []
+    for part in pattern.replace('\\', '/').split('/')[:-1]:
+        if any(char in part for char in GLOB_CHARS):
+            break
+        parts.append(part)
+    return '/'.join(parts) or '.'
+
+
+def find_sources(inputs: list) -> list:
+    """Expand files, directories and globs into (source, root) pairs.
+
+    root is the directory outputs are laid out relative to, so a tree
+    converted into an output directory keeps its structure.
+    """
+    sources = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for dirpath, dirnames, filenames in os.walk(item):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+                sources.extend(
+                    (os.path.join(dirpath, name), item) for name in sorted(filenames)
+                    if name.lower().endswith(MARKDOWN_SUFFIXES)
+                )
+        elif os.path.isfile(item):
+            sources.append((item, os.path.dirname(item) or '.'))
+        elif any(char in item for char in GLOB_CHARS):
+            root = _glob_root(item)
+            sources.extend(
+                (path, root) for path in sorted(glob.glob(item, recursive=True))
+                if os.path.isfile(path)
+            )
+        else:
+            print(f"markforge: {item}: no such file or directory", file=sys.stderr)
+
+    # The same file named twice (a directory and a glob) is converted once
+    seen = set()
+    unique = []
+    for source, root in sources:
+        key = os.path.realpath(source)
+        if key not in seen:
+            seen.add(key)
+            unique.append((source, root))
+    return unique
+
+
+def output_path(source: str, root: str, out_dir: str, fmt: str) -> str:
+    """Where a source's output goes: beside it, or mirrored under out_dir."""
+    name = os.path.splitext(source)[0] + '.' + fmt
+    if not out_dir:
+        return name
+    return os.path.join(out_dir, os.path.relpath(name, root))
+
+
+def default_manifest_path(out_dir: str) -> str:
+    """The output directory's manifest, or a shared one for in-place builds."""
+    if out_dir:
+        return os.path.join(out_dir, MANIFEST_NAME)
+    return os.path.join(default_cache_dir('build'), 'manifest.sqlite3')
+
+
+def is_up_to_date(source: str, output: str) -> bool:
+    """True if the output exists and is at least as new as the source."""
+    try:
+        return os.stat(output).st_mtime_ns >= os.stat(source).st_mtime_ns
+    except OSError:
+        return False
+
+
+def plan(sources: list, out_dir: str, fmt: str, force: bool,
+         manifest: BuildManifest = None, pipeline: str = None):
+    """Split sources into (source, output) pairs to build and a skipped count.
+
+    With a manifest, outputs are current when their source content and the
+    pipeline are unchanged; without one, when they are newer than the source.
+    """
+    todo = []
+    skipped = 0
+    outputs = {}
+    for source, root in sources:
+        output = output_path(source, root, out_dir, fmt)
+        other = outputs.setdefault(os.path.realpath(output), source)
+        if other != source:
+            print(f"markforge: {source}: output {output} already comes from {other}; skipped",
+                  file=sys.stderr)
+            continue
+        if not force and (manifest.is_current(source, output, pipeline) if manifest
+                          else is_up_to_date(source, output)):
+            skipped += 1
+            continue
+        todo.append((source, output))
+    return todo, skipped
+
+
+def _configure_workers() -> None:
+    # Each worker renders in its own process; a nested xhtml2pdf pool per
+    # worker would only oversubscribe the CPUs. Builds are not server
+    # traffic, so keep them out of the shared metrics.
+    os.environ['MARKFORGE_PDF_PROCESSES'] = '0'
+    os.environ['MARKFORGE_METRICS_DIR'] = ''
+
+
+def finish(result: dict, manifest: BuildManifest = None, pipeline: str = None) -> bool:
+    """Report a failed conversion or record a successful one; True on success."""
+    if result['error'] is not None:
+        print(f"markforge: {result['source']}: {result['error']}", file=sys.stderr)
+        if manifest is not None:
+            manifest.forget(result['output'])
+        return False
+    if manifest is not None:
+        manifest.record(result['source'], result['output'], pipeline, result['source_hash'],
+                        result['source_stat'], result['output_stat'])
+    return True
+
+
+def run(todo: list, fmt: str, page_size: str, jobs: int, quiet: bool,
+        manifest: BuildManifest = None, pipeline: str = None) -> int:
+    """Convert every (source, output) pair; returns the number of failures."""
+    failures = 0
+
+    def report(result):
+        nonlocal failures
+        if not finish(result, manifest, pipeline):
+            failures += 1
+        elif not quiet:
+            print(f"{result['source']} -> {result['output']} ({result['seconds'] * 1000:.0f} ms)")
+
+    if jobs <= 1 or len(todo) <= 1:
+        for source, output in todo:
+            report(convert_file(source, output, fmt, page_size))
+        return failures
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(jobs, len(todo)), mp_context=context) as executor:
+        futures = [executor.submit(convert_file, source, output, fmt, page_size) for source, output in todo]
+        for future in as_completed(futures):
+            report(future.result())
+    return failures
+
+
+def _watch_specs(inputs: list) -> list:
+    """(directory to watch, output root, file or pattern to match) per input."""
+    specs = []
+    for item in inputs:
+        if os.path.isdir(item):
+            specs.append((item, item, None))
+        elif any(char in item for char in GLOB_CHARS) and not os.path.isfile(item):
+            root = _glob_root(item)
+            specs.append((root, root, item))
+        else:
+            directory = os.path.dirname(item) or '.'
+            specs.append((directory, directory, os.path.join(directory, os.path.basename(item))))
+    return specs
+
+
+def _match_spec(path: str, specs: list):
+    """Output root for a changed path, or None if no input covers it."""
+    for directory, root, match in specs:
+        if match is None:
+            if path.lower().endswith(MARKDOWN_SUFFIXES) and os.path.relpath(path, directory).split(os.sep)[0] != '..':
+                return root
+        elif not any(char in match for char in GLOB_CHARS):
+            if os.path.normpath(path) == os.path.normpath(match):
+                return root
+        elif fnmatch.fnmatch(path, match) or fnmatch.fnmatch(path, match.replace('**/', '')):
+            return root
+    return None
+
+
+def _percentile_ms(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+
+def watch(inputs: list, todo: list, out_dir: str, fmt: str, page_size: str, jobs: int,
+          quiet: bool, manifest: BuildManifest = None, pipeline: str = None,
+          debounce: float = 0.15, polling: bool = False) -> int:
+    """Convert todo, then re-render sources as they change until interrupted.
+
+    todo is rendered by the same warm worker processes that handle saves.
+    Saves to a file are coalesced until it has been quiet for debounce
+    seconds. A save to a file whose render is in progress kills that
+    render, and the file is rendered again once its saves settle. Each
+    finished render reports its latency from the last save it includes.
+    """
+    specs = _watch_specs(inputs)
+    watcher = make_watcher(sorted({directory for directory, _, _ in specs}), polling)
+    context = multiprocessing.get_context('spawn')
+    workers = [RenderWorker(context, convert_file, _load_server) for _ in range(max(1, jobs))]
+    queue = list(reversed(todo))
+    pending = {}
+    in_flight = {}
+    latencies = []
+    cancelled = failures = 0
+    print(f"Watching {' '.join(inputs)} with {watcher.backend}; press Ctrl+C to stop", flush=True)
+
+    try:
+        while True:
+            now = time.monotonic()
+            deadlines = [entry['last'] + debounce - now for entry in pending.values()]
+            if watcher.next_timeout() is not None:
+                deadlines.append(watcher.next_timeout())
+            if queue:
+                deadlines.append(0.0)
+            waitables = [worker.conn for worker in workers if worker.busy]
+            if watcher.fileno() is not None:
+                waitables.append(watcher.fileno())
+            ready = connection.wait(waitables, max(0.0, min(deadlines)) if deadlines else None)
+
+            now = time.monotonic()
+            for path in watcher.read():
+                root = _match_spec(path, specs)
+                if root is None:
+                    continue
+                for worker in workers:
+                    if worker.busy and worker.job[0] == path:
+                        worker.restart()
+                        cancelled += 1
+                        in_flight.pop(path, None)
+                        if not quiet:
+                            print(f"{path}: saved again, cancelled the render in progress", flush=True)
+                entry = pending.setdefault(path, {'root': root, 'saves': 0})
+                entry['last'] = now
+                entry['saves'] += 1
+
+            for worker in workers:
+                if not worker.busy or worker.conn not in ready:
+                    continue
+                job, result = worker.result()
+                entry = in_flight.pop(job[0], None)
+                if result is None:
+                    result = {'source': job[0], 'output': job[1], 'error': 'render process died'}
+                if not finish(result, manifest, pipeline):
+                    failures += 1
+                    continue
+                if entry is None:
+                    # Part of the initial conversion
+                    if not quiet:
+                        print(f"{result['source']} -> {result['output']} "
+                              f"({result['seconds'] * 1000:.0f} ms)", flush=True)
+                    continue
+                latency = time.monotonic() - entry['last']
+                latencies.append(latency)
+                if not quiet:
+                    coalesced = f", {entry['saves']} saves coalesced" if entry['saves'] > 1 else ''
+                    print(f"{result['source']} -> {result['output']} {latency * 1000:.0f} ms after save "
+                          f"(render {result['seconds'] * 1000:.0f} ms{coalesced})", flush=True)
+
+            idle = [worker for worker in workers if not worker.busy]
+            while queue and idle:
+                source, output = queue.pop()
+                if source not in pending:
+                    idle.pop().submit((source, output, fmt, page_size))
+            for path in [path for path, entry in pending.items() if now - entry['last'] >= debounce]:
+                if not idle:
+                    break
+                entry = pending.pop(path)
+                if not os.path.isfile(path):
+                    continue
+                output = output_path(path, entry['root'], out_dir, fmt)
+                # Editors that rewrite a file unchanged do not trigger a render
+                if manifest is not None and manifest.is_current(path, output, pipeline):
+                    continue
+                idle.pop().submit((path, output, fmt, page_size))
+                in_flight[path] = entry
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.close()
+        watcher.close()
+
+    summary = f"\n{len(latencies)} rendered, {cancelled} cancelled, {failures} failed"
+    if latencies:
+        summary += (f"; save-to-output latency p50 {_percentile_ms(latencies, 0.5):.0f} ms, "
+                    f"p95 {_percentile_ms(latencies, 0.95):.0f} ms, max {max(latencies) * 1000:.0f} ms")
+    print(summary)
+    return 1 if failures else 0
+
+
+def convert_stdin(output: str, fmt: str, page_size: str) -> int:
+    """Convert Markdown from stdin to a file, or to stdout without one."""
+    markdown_text = sys.stdin.buffer.read().decode('utf-8')
+    try:
+        # The pipeline reports problems with print(); keep stdout for the output
+        with contextlib.redirect_stdout(sys.stderr):
+            data = convert_text(markdown_text, fmt, page_size, 'stdin')
+        if output:
+            write_atomic(output, data)
+        else:
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+    except Exception as e:
+        print(f"markforge: stdin: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='markforge',
+        description='Convert Markdown files to PDF or HTML.'
+    )
+    parser.add_argument('inputs', nargs='*',
+                        help="files, directories or glob patterns; '-' (or none) reads stdin")
+    parser.add_argument('-o', '--output',
+                        help='output directory (default: beside each source); '
+                             'for stdin, the output file (default: stdout)')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='pdf')
+    parser.add_argument('--page-size', default='A4', help='PDF page size (A4, Letter, Legal, A3, A5)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='parallel conversions (default: CPU count; 2 while watching)')
+    parser.add_argument('--force', action='store_true', help='convert even if the output is up to date')
+    parser.add_argument('--manifest',
+                        help=f'build manifest to skip unchanged sources by content hash '
+                             f'(default: {MANIFEST_NAME} in the output directory)')
+    parser.add_argument('--no-manifest', action='store_true',
+                        help='compare modification times instead of keeping a manifest')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='after converting, keep re-rendering files as they change')
+    parser.add_argument('--debounce-ms', type=float, default=150,
+                        help='watch mode: wait this long after the last save before rendering')
+    parser.add_argument('--poll', action='store_true', help='watch mode: poll instead of using inotify')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report errors')
+    args = parser.parse_args(argv)
+    _configure_workers()
+
+    inputs = args.inputs
+    if not inputs or inputs == ['-']:
+        if not inputs and sys.stdin.isatty():
+            parser.error('no inputs given')
+        return convert_stdin(args.output, args.format, args.page_size)
+    if '-' in inputs:
+        parser.error("'-' cannot be combined with other inputs")
+    if args.watch:
+        missing = [item for item in inputs if not os.path.exists(item)
+                   and not any(char in item for char in GLOB_CHARS)]
+        if missing:
+            parser.error(f"cannot watch {', '.join(missing)}: no such file or directory")
+
+    start = time.perf_counter()
+    sources = find_sources(inputs)
+    if not sources and not args.watch:
+        print("markforge: no Markdown files found", file=sys.stderr)
+        return 1
+
+    manifest = pipeline = None
+    if not args.no_manifest:
+        manifest = BuildManifest(args.manifest or os.environ.get('MARKFORGE_BUILD_MANIFEST')
+                                 or default_manifest_path(args.output))
+        pipeline = pipeline_version(args.format, args.page_size)
+    todo, skipped = plan(sources, args.output, args.format, args.force, manifest, pipeline)
+    if args.watch:
+        if not args.quiet:
+            print(f"{len(todo)} to convert, {skipped} up to date")
+        return watch(inputs, todo, args.output, args.format, args.page_size, args.jobs or 2, args.quiet,
+                     manifest, pipeline, args.debounce_ms / 1000, args.poll)
+    failures = run(todo, args.format, args.page_size, args.jobs or os.cpu_count() or 1,
+                   args.quiet, manifest, pipeline)
+
+    if not args.quiet:
+        print(f"{len(todo) - failures} converted, {skipped} up to date, {failures} failed "
+              f"in {time.perf_counter() - start:.1f} s")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
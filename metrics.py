@@ -0,0 +1,426 @@
+"""
+MarkForge - Lightweight Prometheus metrics
+Counters and histograms rendered in the Prometheus text format, plus stage
+timers for the conversion pipeline. Each gunicorn worker keeps its own
+values in memory and periodically writes a snapshot to a shared directory,
+so /metrics on any worker reports the totals of all of them.
+"""
+
+import bisect
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from cache import HAS_FCNTL, default_cache_dir
+
+if HAS_FCNTL:
+    import fcntl
+
+# Seconds; covers a cached preview (ms) up to a large PDF render (minute)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FLUSH_SECONDS = float(os.environ.get('MARKFORGE_METRICS_FLUSH_SECONDS', 5))
+# Totals of workers that have exited, kept so counters never go backwards
+RETIRED_SNAPSHOT = 'retired.json'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(total: dict, snapshot: dict) -> None:
+        for key, value in snapshot.items():
+            total[key] = total.get(key, 0) + value
+
+    def render(self, merged: dict) -> list:
+        return [
+            f'{self.name}{_format_labels(self.labelnames, json.loads(key))} {value:g}'
+            for key, value in sorted(merged.items())
+        ]
+
+
+class Histogram:
+    """Histogram with fixed buckets; observing is a bisect and a locked add."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): list(entry) for key, entry in self._values.items()}
+
+    @staticmethod
+    def merge(total: dict, snapshot: dict) -> None:
+        for key, entry in snapshot.items():
+            current = total.get(key)
+            if current is None or len(current) != len(entry):
+                total[key] = list(entry)
+            else:
+                total[key] = [a + b for a, b in zip(current, entry)]
+
+    def render(self, merged: dict) -> list:
+        lines = []
+        for key, entry in sorted(merged.items()):
+            values = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {entry[-1]:.6g}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Set of metrics rendered together, optionally shared between processes.
+
+    With a directory, each process writes its snapshot to <dir>/<pid>.json
+    every FLUSH_SECONDS and render() adds up the snapshots of every live
+    process, so scrapes give the same totals whichever worker answers. The
+    snapshot of a process that has exited is folded into retired.json
+    before its file is removed.
+    """
+
+    def __init__(self, directory: str = None, flush_seconds: float = FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._metrics = {}
+        self._flusher = None
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _merge_snapshots(self, snapshots: list) -> dict:
+        merged = {}
+        for name, metric in self._metrics.items():
+            values = {}
+            for snapshot in snapshots:
+                metric.merge(values, snapshot.get(name, {}))
+            merged[name] = values
+        return merged
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def _write(self, path: str, snapshot: dict) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def flush(self) -> None:
+        """Write this process's snapshot to the shared directory."""
+        if not self.directory:
+            return
+        self._write(self._snapshot_path(os.getpid()), self.snapshot())
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Metrics flush failed: {e}")
+
+    def start(self) -> None:
+        """Start the background flusher (once per process)."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='markforge-metrics', daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _other_snapshots(self) -> list:
+        lock_file = None
+        if HAS_FCNTL:
+            # Held while reading, so no scrape sees a snapshot both retired and live
+            try:
+                lock_file = open(os.path.join(self.directory, '.metrics.lock'), 'w')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except OSError:
+                if lock_file is not None:
+                    lock_file.close()
+                return []
+        try:
+            return self._collect_snapshots()
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def _collect_snapshots(self) -> list:
+        own = f'{os.getpid()}.json'
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        snapshots = []
+        dead = []
+        for name in names:
+            if not name.endswith('.json') or name in (own, RETIRED_SNAPSHOT):
+                continue
+            path = os.path.join(self.directory, name)
+            snapshot = self._load(path)
+            if not _pid_alive(name[:-5]):
+                # Leftover from a worker that exited
+                dead.append((path, snapshot))
+            elif snapshot is not None:
+                snapshots.append(snapshot)
+
+        retired_path = os.path.join(self.directory, RETIRED_SNAPSHOT)
+        retired = self._load(retired_path) or {}
+        if dead:
+            retired = self._merge_snapshots([retired] + [s for _, s in dead if s is not None])
+            try:
+                self._write(retired_path, retired)
+            except OSError as e:
+                print(f"Metrics retire failed: {e}")
+                return snapshots + [s for _, s in dead if s is not None]
+            for path, _ in dead:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        snapshots.append(retired)
+        return snapshots
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            snapshots.extend(self._other_snapshots())
+
+        lines = []
+        merged_snapshots = self._merge_snapshots(snapshots)
+        for name, metric in self._metrics.items():
+            merged = merged_snapshots[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.render(merged))
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid: str) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return False
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # Exists but owned by someone else, or no way to tell (Windows)
+        return True
+    return True
+
+
+# Endpoint of the request being handled, set by the server per request
+_endpoint = ContextVar('markforge_metrics_endpoint', default='')
+# Time spent in nested stages of the stage currently being timed
+_nested = threading.local()
+
+
+@contextmanager
+def bind_endpoint(endpoint: str):
+    """Attribute stages timed in this context to an endpoint."""
+    token = _endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+def set_endpoint(endpoint: str):
+    """Attribute stages to an endpoint until reset_endpoint(token)."""
+    return _endpoint.set(endpoint)
+
+
+def reset_endpoint(token) -> None:
+    try:
+        _endpoint.reset(token)
+    except ValueError:
+        # A streamed body finished in a different context than it started
+        _endpoint.set('')
+
+
+def current_endpoint() -> str:
+    return _endpoint.get()
+
+
+def add_time(stage: str, seconds: float) -> None:
+    """Credit time to a nested stage of the stage being timed on this thread."""
+    stages = getattr(_nested, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def collect_nested():
+    """Collect add_time() calls made on this thread into the yielded dict."""
+    previous = getattr(_nested, 'stages', None)
+    stages = _nested.stages = {}
+    try:
+        yield stages
+    finally:
+        _nested.stages = previous
+
+
+def instance_metrics_dir() -> str:
+    """Default snapshot directory, one per server instance.
+
+    gunicorn workers share their master's pid as parent, so workers of one
+    deployment meet in the same directory while other instances on the
+    host, and earlier runs, use their own. Directories of parents that
+    have exited are removed.
+    """
+    root = default_cache_dir('metrics')
+    try:
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.isdigit() and os.path.isdir(path) and not _pid_alive(name):
+                shutil.rmtree(path, ignore_errors=True)
+    except OSError:
+        pass
+    return os.path.join(root, str(os.getppid()))
+
+
+# Pipeline metrics. Snapshots are shared through MARKFORGE_METRICS_DIR
+# (default: per instance, see instance_metrics_dir); set it to an empty
+# string to report each process on its own.
+_metrics_dir = os.environ.get('MARKFORGE_METRICS_DIR')
+REGISTRY = MetricsRegistry(instance_metrics_dir() if _metrics_dir is None else _metrics_dir or None)
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'markforge_stage_seconds', 'Time spent in each conversion pipeline stage.',
+    ('stage', 'endpoint', 'page_size', 'backend')
+)
+REQUESTS = REGISTRY.counter(
+    'markforge_requests_total', 'HTTP requests handled.', ('endpoint', 'method', 'status')
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'markforge_request_seconds', 'Time until the response is returned; streamed bodies excluded.',
+    ('endpoint',)
+)
+PDF_FALLBACKS = REGISTRY.counter(
+    'markforge_pdf_fallbacks_total', 'xhtml2pdf renders that failed and fell back to Playwright.',
+    ('endpoint',)
+)
+ADMISSIONS = REGISTRY.counter(
+    'markforge_admission_total', 'Requests admitted or shed by admission control, by traffic class.',
+    ('traffic', 'outcome')
+)
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    'markforge_admission_wait_seconds', 'Time admitted requests spent queued for a slot.',
+    ('traffic',)
+)
+PDF_WAIT_SECONDS = REGISTRY.histogram(
+    'markforge_pdf_wait_seconds', 'Time PDF renders waited for a render slot, by priority class.',
+    ('priority',)
+)
+PDF_LATENCY_SECONDS = REGISTRY.histogram(
+    'markforge_pdf_latency_seconds', 'Time from requesting a render slot to finishing the render, by priority class.',
+    ('priority',)
+)
+
+
+@contextmanager
+def stage(name: str, page_size: str = '', backend: str = ''):
+    """Time a pipeline stage for the current endpoint.
+
+    Time credited with add_time() inside the block (code highlighting,
+    stylesheet parsing) is reported under its own stage name and left out
+    of this one. Stages do not nest.
+    """
+    start = time.perf_counter()
+    try:
+        with collect_nested() as nested:
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        endpoint = _endpoint.get()
+        for nested_name, seconds in nested.items():
+            STAGE_SECONDS.observe(seconds, stage=nested_name, endpoint=endpoint,
+                                  page_size=page_size, backend=backend)
+            elapsed -= seconds
+        STAGE_SECONDS.observe(max(elapsed, 0.0), stage=name, endpoint=endpoint,
+                              page_size=page_size, backend=backend)
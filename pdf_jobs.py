@@ -0,0 +1,168 @@
+"""
+MarkForge - Asynchronous PDF job queue
+Runs PDF conversions on a bounded worker pool off the request thread.
+Job state lives in SQLite and results in a shared directory, so any gunicorn
+worker can answer status and result requests for a job submitted elsewhere.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DEFAULT_WORKERS = int(os.environ.get('MARKFORGE_JOB_WORKERS', 2))
+DEFAULT_MAX_PENDING = int(os.environ.get('MARKFORGE_JOB_MAX_PENDING', 16))
+DEFAULT_TTL = int(os.environ.get('MARKFORGE_JOB_TTL', 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    progress INTEGER NOT NULL,
+    error TEXT,
+    filename TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    expires REAL NOT NULL
+)
+"""
+
+
+class QueueFull(Exception):
+    """Raised when the job queue cannot accept more work."""
+
+
+class PDFJobQueue:
+    """Bounded, SQLite-backed queue of PDF conversion jobs."""
+
+    def __init__(self, render, directory: str, workers: int = DEFAULT_WORKERS,
+                 max_pending: int = DEFAULT_MAX_PENDING, ttl: int = DEFAULT_TTL):
+        """render(markdown_text, page_size, progress, client) must return PDF
+        bytes; progress(stage, percent) reports intermediate steps and client
+        identifies who submitted the job."""
+        self.render = render
+        self.directory = directory
+        self.ttl = ttl
+        self.max_pending = max_pending
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'jobs.sqlite3')
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='markforge-job')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._last_purge = 0.0
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection, committing on success."""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields['updated'] = time.time()
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as conn:
+            conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f'{job_id}.pdf')
+
+    def submit(self, markdown_text: str, page_size: str = 'A4',
+               filename: str = 'document.pdf', client: str = '') -> str:
+        """Queue a conversion and return its job id.
+
+        Raises QueueFull when max_pending jobs are already queued or running
+        in this worker, so callers can shed load instead of piling up.
+        """
+        if not self._pending.acquire(blocking=False):
+            raise QueueFull(f"PDF job queue is full ({self.max_pending} pending)")
+
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    'INSERT INTO jobs (id, status, stage, progress, error, filename, created, updated, expires) '
+                    'VALUES (?, ?, ?, ?, NULL, ?, ?, ?, ?)',
+                    (job_id, 'queued', 'queued', 0, filename, now, now, now + self.ttl)
+                )
+            self._executor.submit(self._run, job_id, markdown_text, page_size, client)
+        except Exception:
+            self._pending.release()
+            raise
+        return job_id
+
+    def _run(self, job_id: str, markdown_text: str, page_size: str, client: str) -> None:
+        try:
+            self._update(job_id, status='running', stage='started', progress=5)
+
+            def progress(stage: str, percent: int):
+                self._update(job_id, stage=stage, progress=percent)
+
+            pdf_bytes = self.render(markdown_text, page_size, progress, client)
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, self.result_path(job_id))
+
+            # Results expire ttl seconds after completion
+            self._update(job_id, status='done', stage='done', progress=100,
+                         expires=time.time() + self.ttl)
+        except Exception as e:
+            print(f"PDF job {job_id} failed: {e}")
+            self._update(job_id, status='failed', stage='failed', error=str(e),
+                         expires=time.time() + self.ttl)
+        finally:
+            self._pending.release()
+
+    def status(self, job_id: str):
+        """Return the job record as a dict, or None if unknown or expired."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or row['expires'] < time.time():
+            return None
+        return {
+            'job_id': row['id'],
+            'status': row['status'],
+            'stage': row['stage'],
+            'progress': row['progress'],
+            'error': row['error'],
+            'filename': row['filename'],
+            'created': row['created'],
+            'expires': row['expires'],
+        }
+
+    def purge_expired(self, min_interval: float = 60.0) -> None:
+        """Delete expired job records and result files (at most once per interval)."""
+        now = time.time()
+        if now - self._last_purge < min_interval:
+            return
+        self._last_purge = now
+        with self._connect() as conn:
+            expired = [row['id'] for row in
+                       conn.execute('SELECT id FROM jobs WHERE expires < ?', (now,))]
+            conn.execute('DELETE FROM jobs WHERE expires < ?', (now,))
+        for job_id in expired:
+            try:
+                os.unlink(self.result_path(job_id))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
@@ -0,0 +1,100 @@
+"""
+MarkForge - Reusable PDF styles for xhtml2pdf
+Builds each theme's stylesheet once per page size and lets xhtml2pdf reuse
+parsed stylesheets across renders instead of re-parsing them per document.
+"""
+
+import re
+import threading
+import time
+from functools import lru_cache
+
+from metrics import add_time
+
+# Page sizes offered in the UI, as CSS @page size values
+PAGE_SIZES = {
+    'A4': 'a4 portrait',
+    'Letter': 'letter portrait',
+    'Legal': 'legal portrait',
+    'A3': 'a3 portrait',
+    'A5': 'a5 portrait',
+}
+
+PAGE_RULE_RE = re.compile(r'@page\b[^{]*\{[^{}]*\}', re.IGNORECASE)
+PAGE_SIZE_RE = re.compile(r'\bsize\s*:\s*[^;}]+', re.IGNORECASE)
+
+# Parsing these changes the render context (page templates, frames, fonts,
+# custom properties), so stylesheets containing them are parsed every time.
+STATEFUL_CSS = ('@page', '@font-face', '@frame', '@import', '--')
+MAX_PARSED_STYLESHEETS = 64
+
+
+class PDFStyle:
+    """A theme's stylesheet for one page size, split for parse caching.
+
+    The @page rules go in their own small <style> block because xhtml2pdf
+    builds page templates from them on every render. The rest of the theme
+    is identical across renders and is parsed once per process.
+    """
+
+    def __init__(self, theme_css: str, page_size: str = 'A4'):
+        self.page_size = page_size if page_size in PAGE_SIZES else 'A4'
+        size = f'size: {PAGE_SIZES[self.page_size]}'
+        self.page_css = '\n'.join(
+            PAGE_SIZE_RE.sub(size, rule, count=1) if PAGE_SIZE_RE.search(rule)
+            else rule.replace('{', '{\n    ' + size + ';', 1)
+            for rule in PAGE_RULE_RE.findall(theme_css)
+        )
+        self.body_css = PAGE_RULE_RE.sub('', theme_css).strip()
+        self.style_tags = f'<style>{self.page_css}</style>\n    <style>{self.body_css}</style>'
+
+
+@lru_cache(maxsize=32)
+def get_pdf_style(theme_css: str, page_size: str = 'A4') -> PDFStyle:
+    """Return the shared PDFStyle for a theme and page size."""
+    return PDFStyle(theme_css, page_size)
+
+
+_parsed_stylesheets = {}
+_parsed_lock = threading.Lock()
+_cache_installed = False
+
+
+def install_stylesheet_cache() -> None:
+    """Make xhtml2pdf reuse parsed stylesheets that have no side effects.
+
+    xhtml2pdf parses every <style> block and its default stylesheet from
+    scratch for each document and offers no hook to share the result, so
+    pisaContext._parseCSSSource is wrapped once per process.
+    """
+    global _cache_installed
+    with _parsed_lock:
+        if _cache_installed:
+            return
+        _cache_installed = True
+
+    from xhtml2pdf.context import pisaContext
+
+    parse = getattr(pisaContext, '_parseCSSSource', None)
+    if parse is None:
+        print("xhtml2pdf stylesheet cache not supported by this version.")
+        return
+
+    def parse_cached(self, text, sourceName):
+        start = time.perf_counter()
+        lowered = text.lower()
+        if any(marker in lowered for marker in STATEFUL_CSS):
+            parsed = parse(self, text, sourceName)
+        else:
+            key = (text, sourceName, self.pathDirectory)
+            parsed = _parsed_stylesheets.get(key)
+            if parsed is None:
+                parsed = parse(self, text, sourceName)
+                with _parsed_lock:
+                    if len(_parsed_stylesheets) >= MAX_PARSED_STYLESHEETS:
+                        _parsed_stylesheets.pop(next(iter(_parsed_stylesheets)))
+                    _parsed_stylesheets[key] = parsed
+        add_time('css', time.perf_counter() - start)
+        return parsed
+
+    pisaContext._parseCSSSource = parse_cached
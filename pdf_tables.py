@@ -0,0 +1,94 @@
+"""
+MarkForge - Large-table fast path for xhtml2pdf
+ReportLab re-measures every remaining row each time a table breaks across a
+page, so layout time grows with the square of the row count and tables
+with thousands of rows take minutes or fail. Large tables are split into
+chunks of rows, each with the header repeated and the same column widths,
+before layout; small tables are left alone.
+"""
+
+import html
+import os
+import re
+
+# Tables with more body rows than this are split
+LARGE_TABLE_ROWS = int(os.environ.get('MARKFORGE_PDF_LARGE_TABLE_ROWS', 200))
+# Rows per chunk, about three A4 pages of single-line rows. xhtml2pdf repeats
+# the header on every page a chunk spans, so the header only shows mid-page
+# where one chunk ends and the next begins.
+CHUNK_ROWS = int(os.environ.get('MARKFORGE_PDF_TABLE_CHUNK_ROWS', 100))
+
+# Only the bare tables the Markdown tables extension emits; raw HTML tables
+# with attributes of their own are left as written
+TABLE_RE = re.compile(r'<table>\n?(<thead>.*?</thead>)\s*<tbody>(.*?)</tbody>\s*</table>', re.DOTALL)
+ROW_RE = re.compile(r'<tr>.*?</tr>', re.DOTALL)
+CELL_RE = re.compile(r'<t([hd])(\s[^>]*)?>(.*?)</t\1>', re.DOTALL)
+TAG_RE = re.compile(r'<[^>]+>')
+
+# Column width weights in characters, so one long note column cannot
+# squeeze the others down to nothing
+MIN_COLUMN_CHARS = 4
+MAX_COLUMN_CHARS = 40
+
+
+def _cell_lengths(row: str) -> list:
+    return [len(html.unescape(TAG_RE.sub('', cell[2])).strip()) for cell in CELL_RE.findall(row)]
+
+
+def column_widths(header: str, rows: list) -> list:
+    """Return column widths in percent from the longest text in each column."""
+    longest = _cell_lengths(header)
+    for row in rows:
+        for col, length in enumerate(_cell_lengths(row)):
+            if col < len(longest):
+                longest[col] = max(longest[col], length)
+            else:
+                longest.append(length)
+    weights = [min(max(length, MIN_COLUMN_CHARS), MAX_COLUMN_CHARS) for length in longest]
+    total = sum(weights) or 1
+    return [round(100 * weight / total, 1) for weight in weights]
+
+
+def _fix_header_widths(header: str, widths: list) -> str:
+    """Give each header cell its column width so every chunk lines up."""
+    cells = iter(widths)
+
+    def add_width(match):
+        width = next(cells, None)
+        if width is None:
+            return match.group(0)
+        return f'<t{match.group(1)}{match.group(2) or ""} width="{width}%">{match.group(3)}</t{match.group(1)}>'
+
+    return CELL_RE.sub(add_width, header)
+
+
+def split_large_tables(html_content: str, max_rows: int = LARGE_TABLE_ROWS,
+                       chunk_rows: int = CHUNK_ROWS) -> str:
+    """Split tables with more than max_rows body rows into chunked tables.
+
+    The chunks are wrapped in <div class="large-table"> and carry the
+    table-chunk class; the stylesheet lets them break across pages and
+    joins them up without gaps. Runs in time linear in the HTML size.
+    """
+    if max_rows <= 0 or '<table>' not in html_content:
+        return html_content
+    # An even chunk size keeps the zebra striping continuous across chunks
+    chunk_rows = max(2, chunk_rows + chunk_rows % 2)
+
+    def split(match):
+        header, body = match.group(1), match.group(2)
+        if body.count('<tr>') <= max_rows or '<table' in body:
+            return match.group(0)
+        rows = ROW_RE.findall(body)
+        if len(rows) <= max_rows:
+            return match.group(0)
+        header = _fix_header_widths(header, column_widths(header, rows))
+        chunks = [
+            f'<table class="table-chunk">\n{header}\n<tbody>\n'
+            + '\n'.join(rows[start:start + chunk_rows])
+            + '\n</tbody>\n</table>'
+            for start in range(0, len(rows), chunk_rows)
+        ]
+        return '<div class="large-table">\n' + '\n'.join(chunks) + '\n</div>'
+
+    return TABLE_RE.sub(split, html_content)
@@ -0,0 +1,169 @@
+"""
+MarkForge - Process pool for xhtml2pdf rendering
+xhtml2pdf is pure Python and CPU-bound, so threads in one gunicorn worker
+cannot render in parallel. This module renders in pre-warmed child
+processes instead. It is imported by the children, so keep module-level
+imports light.
+"""
+
+import io
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import add_time, collect_nested
+from pdf_styles import install_stylesheet_cache
+from reproducible import REPRODUCIBLE, pin_xhtml2pdf
+
+DEFAULT_PROCESSES = int(os.environ.get('MARKFORGE_PDF_PROCESSES', 0))
+DEFAULT_MAX_TASKS_PER_CHILD = int(os.environ.get('MARKFORGE_PDF_MAX_TASKS_PER_CHILD', 50))
+DEFAULT_TIMEOUT = float(os.environ.get('MARKFORGE_PDF_TIMEOUT', 90))
+
+
+def render_xhtml2pdf_to(full_html: str, dest) -> None:
+    """Render a complete HTML document with xhtml2pdf into a binary file object."""
+    from xhtml2pdf import pisa
+
+    install_stylesheet_cache()
+    if REPRODUCIBLE:
+        pin_xhtml2pdf()
+    pisa_status = pisa.CreatePDF(
+        src=full_html,
+        dest=dest,
+        encoding='UTF-8'
+    )
+    if pisa_status.err:
+        raise Exception(f"xhtml2pdf error: {pisa_status.err}")
+
+
+def render_xhtml2pdf(full_html: str) -> bytes:
+    """Render a complete HTML document to PDF bytes with xhtml2pdf."""
+    result = io.BytesIO()
+    render_xhtml2pdf_to(full_html, result)
+    return result.getvalue()
+
+
+def render_xhtml2pdf_timed(full_html: str) -> tuple:
+    """Render to PDF bytes, also returning nested stage timings for the parent."""
+    with collect_nested() as nested:
+        pdf_bytes = render_xhtml2pdf(full_html)
+    return pdf_bytes, nested
+
+
+def _warm_up():
+    """Child initializer: import xhtml2pdf/reportlab and load the base fonts."""
+    try:
+        render_xhtml2pdf('<html><body><p>MarkForge</p><pre>code</pre></body></html>')
+    except Exception as e:
+        print(f"PDF worker warm-up failed: {e}")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class PDFProcessPool:
+    """ProcessPoolExecutor of xhtml2pdf renderers with per-job timeouts.
+
+    A render that exceeds its timeout cannot be interrupted inside the
+    child, so the whole executor is terminated and replaced. Other renders
+    caught by the restart are retried once on the fresh pool.
+    """
+
+    def __init__(self, processes: int, max_tasks_per_child: int = DEFAULT_MAX_TASKS_PER_CHILD,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.processes = max(1, processes)
+        self.max_tasks_per_child = max_tasks_per_child
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self.renders = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        options = {}
+        # max_tasks_per_child is Python 3.11+ and requires a non-fork start
+        # method; on 3.10 children live until the pool is restarted
+        if sys.version_info >= (3, 11):
+            options['max_tasks_per_child'] = self.max_tasks_per_child or None
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_up,
+            **options,
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            return self._executor
+
+    def warm(self) -> None:
+        """Start and warm up every child process ahead of the first request."""
+        executor = self._get_executor()
+        futures = [executor.submit(_ping) for _ in range(self.processes)]
+        for future in futures:
+            future.result()
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """Kill the children of a broken or hung executor and replace it."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.restarts += 1
+        for process in list((getattr(broken, '_processes', None) or {}).values()):
+            try:
+                process.kill()
+            except Exception:
+                pass
+        broken.shutdown(wait=False, cancel_futures=True)
+        threading.Thread(target=self.warm, daemon=True).start()
+
+    def _submit(self, full_html: str, timeout: float) -> bytes:
+        executor = self._get_executor()
+        future = executor.submit(render_xhtml2pdf_timed, full_html)
+        try:
+            pdf_bytes, nested = future.result(timeout=timeout)
+        except FutureTimeout:
+            self.timeouts += 1
+            self._restart(executor)
+            raise TimeoutError(f"PDF render exceeded {timeout:g}s and was killed")
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        self.renders += 1
+        # Report the child's stylesheet parsing time to the caller's stage
+        for stage, seconds in nested.items():
+            add_time(stage, seconds)
+        return pdf_bytes
+
+    def render(self, full_html: str, timeout: float = None) -> bytes:
+        """Render HTML to PDF in a child process, killing it after timeout seconds."""
+        timeout = timeout or self.timeout
+        try:
+            return self._submit(full_html, timeout)
+        except BrokenProcessPool:
+            # Another job's timeout (or a crashed child) took the pool down
+            return self._submit(full_html, timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            'processes': self.processes,
+            'max_tasks_per_child': self.max_tasks_per_child,
+            'timeout': self.timeout,
+            'renders': self.renders,
+            'timeouts': self.timeouts,
+            'restarts': self.restarts,
+        }
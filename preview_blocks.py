@@ -0,0 +1,225 @@
+"""
+MarkForge - Incremental block-level preview rendering
+Splits a document into top-level Markdown blocks, renders only blocks whose
+source changed and reports stable block ids so the editor can patch the
+preview DOM in place instead of replacing it wholesale.
+"""
+
+import hashlib
+import re
+
+from markdown.extensions.toc import unique
+from markdown.util import BLOCK_LEVEL_ELEMENTS
+
+from cache import content_key
+from code_highlight import track_degraded
+
+FENCE_RE = re.compile(r'^(`{3,}|~{3,})')
+LIST_ITEM_RE = re.compile(r'^ {0,3}(?:[*+-]|\d+[.)])[ \t]+')
+REF_DEF_RE = re.compile(r'^ {0,3}\[[^\]]+\]:[ \t]*\S.*$')
+SETEXT_RE = re.compile(r'^ {0,3}(=+|-+)[ \t]*$')
+HEADING_ID_RE = re.compile(r'(<h[1-6][^>]*\sid=")([^"]*)(")')
+# A raw HTML block starts with a block-level tag or a comment at line start
+HTML_BLOCK_RE = re.compile(r'^ {0,3}(?:<!--|<([a-zA-Z][a-zA-Z0-9]*)(?=[\s/>]|$))')
+HTML_VOID_ELEMENTS = {'hr'}
+
+TOC_MARKER = '[TOC]'
+
+
+def _block_kind(lines: list) -> str:
+    first = lines[0]
+    if LIST_ITEM_RE.match(first):
+        return 'list'
+    if first.lstrip().startswith('>'):
+        return 'quote'
+    return 'other'
+
+
+class _RawHtml:
+    """Tracks a raw HTML block until its opening tag is closed."""
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.depth = 0
+        if tag is not None:
+            self.open_re = re.compile(rf'<{tag}(?=[\s>])[^>]*(?<!/)>|<{tag}>', re.IGNORECASE)
+            self.close_re = re.compile(rf'</{tag}\s*>', re.IGNORECASE)
+
+    def feed(self, line: str) -> bool:
+        """Consume a line; True once the block has ended."""
+        if self.tag is None:
+            return '-->' in line
+        self.depth += len(self.open_re.findall(line)) - len(self.close_re.findall(line))
+        return self.depth <= 0
+
+
+def _raw_html_start(line: str):
+    """Return a _RawHtml for a line that opens a multi-line raw HTML block."""
+    match = HTML_BLOCK_RE.match(line)
+    if match is None:
+        return None
+    tag = match.group(1)
+    if tag is not None:
+        tag = tag.lower()
+        if tag not in BLOCK_LEVEL_ELEMENTS or tag in HTML_VOID_ELEMENTS:
+            return None
+    raw_html = _RawHtml(tag)
+    return None if raw_html.feed(line) else raw_html
+
+
+def split_blocks(markdown_text: str) -> list:
+    """Split Markdown into top-level blocks that render independently.
+
+    Blank-line separated chunks are merged back together whenever splitting
+    them would change the output: fenced code and raw HTML blocks spanning
+    blank lines, indented continuations, loose lists and consecutive
+    blockquotes. Like the full render, an HTML block that is never closed
+    runs to the end of the document.
+    """
+    chunks = []
+    current = []
+    fence = None
+    raw_html = None
+    for line in markdown_text.split('\n'):
+        if raw_html is not None:
+            current.append(line)
+            if raw_html.feed(line):
+                raw_html = None
+            continue
+        if fence is not None:
+            current.append(line)
+            if line.rstrip() == fence:
+                fence = None
+            continue
+        match = FENCE_RE.match(line)
+        if match:
+            fence = match.group(1)
+            current.append(line)
+            continue
+        if not line.strip():
+            if current:
+                chunks.append(current)
+                current = []
+            continue
+        if not current:
+            raw_html = _raw_html_start(line)
+        current.append(line)
+    if current:
+        chunks.append(current)
+
+    blocks = []
+    kinds = []
+    for chunk in chunks:
+        kind = _block_kind(chunk)
+        continues_previous = blocks and (
+            chunk[0].startswith((' ', '\t'))
+            or kind in ('list', 'quote') and kinds[-1] == kind
+        )
+        if continues_previous:
+            blocks[-1].extend([''] + chunk)
+        else:
+            blocks.append(chunk)
+            kinds.append(kind)
+    return ['\n'.join(block) for block in blocks]
+
+
+def _outside_fences(markdown_text: str):
+    """Yield (line, next_line) pairs for lines outside fenced code."""
+    lines = markdown_text.split('\n')
+    fence = None
+    for i, line in enumerate(lines):
+        if fence is not None:
+            if line.rstrip() == fence:
+                fence = None
+            continue
+        match = FENCE_RE.match(line)
+        if match:
+            fence = match.group(1)
+            continue
+        yield line, lines[i + 1] if i + 1 < len(lines) else ''
+
+
+def document_context(markdown_text: str):
+    """Collect the cross-block context: reference definitions and headings."""
+    references = []
+    headings = []
+    for line, next_line in _outside_fences(markdown_text):
+        if REF_DEF_RE.match(line):
+            references.append(line.strip())
+        elif line.lstrip().startswith('#'):
+            headings.append(line.strip())
+        elif line.strip() and SETEXT_RE.match(next_line):
+            headings.append(line.strip() + '\n' + next_line.strip())
+    return '\n'.join(references), '\n'.join(headings)
+
+
+class BlockRenderer:
+    """Render Markdown block by block through the renderer pool and cache."""
+
+    def __init__(self, pool, cache):
+        self.pool = pool
+        self.cache = cache
+
+    def _cached(self, key: str, render) -> str:
+        html_content = self.cache.get(key)
+        if html_content is None:
+            with track_degraded() as status:
+                html_content = render()
+            if not status.degraded:
+                self.cache.set(key, html_content)
+        return html_content
+
+    def _render_toc(self, markdown_text: str, headings: str, guess_lang: bool = None) -> str:
+        def render():
+            with self.pool.renderer(guess_lang) as md:
+                md.convert(markdown_text)
+                return md.toc
+        key = content_key('toc', headings, self.pool.fingerprint_for(guess_lang))
+        return self._cached(key, render)
+
+    def _render_block(self, block: str, references: str, guess_lang: bool = None) -> str:
+        # Reference-style links resolve against definitions anywhere in the
+        # document, so blocks using brackets carry the definitions along.
+        source = block
+        if references and '[' in block:
+            source = block + '\n\n' + references
+        key = content_key('block', source, self.pool.fingerprint_for(guess_lang))
+        return self._cached(key, lambda: self.pool.convert(source, guess_lang))
+
+    def render(self, markdown_text: str, known=(), guess_lang: bool = None) -> dict:
+        """Render a document, returning ordered block ids and new fragments.
+
+        Fragments are only included for block ids not listed in known, which
+        is the set of blocks the client already has in its DOM.
+        """
+        references, headings = document_context(markdown_text)
+        known = set(known or ())
+        used_ids = set()
+        seen = {}
+        block_ids = []
+        fragments = {}
+
+        for block in split_blocks(markdown_text):
+            if block.strip() == TOC_MARKER:
+                # The toc extension only replaces a paragraph that is exactly
+                # the marker, and the table of contents spans every block.
+                fragment = self._render_toc(markdown_text, headings, guess_lang)
+            else:
+                fragment = self._render_block(block, references, guess_lang)
+
+            # Heading ids must stay unique across the whole document, exactly
+            # as the toc extension would assign them in a full render.
+            fragment = HEADING_ID_RE.sub(
+                lambda m: m.group(1) + unique(m.group(2), used_ids) + m.group(3),
+                fragment
+            )
+
+            digest = hashlib.sha1(fragment.encode('utf-8')).hexdigest()[:16]
+            occurrence = seen.get(digest, 0)
+            seen[digest] = occurrence + 1
+            block_id = f'b{digest}' if occurrence == 0 else f'b{digest}-{occurrence}'
+            block_ids.append(block_id)
+            if block_id not in known:
+                fragments[block_id] = fragment
+
+        return {'blocks': block_ids, 'fragments': fragments}
@@ -0,0 +1,163 @@
+"""
+MarkForge - Opt-in sampling profiler for slow requests
+A single background thread samples the stacks of the request threads being
+profiled and writes each finished profile as collapsed stacks (one
+"frame;frame;frame count" line per stack, readable by flamegraph.pl and
+speedscope) into a bounded directory.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+SAMPLE_INTERVAL_MS = float(os.environ.get('MARKFORGE_PROFILE_INTERVAL_MS', 10))
+MAX_PROFILES = int(os.environ.get('MARKFORGE_PROFILE_KEEP', 50))
+# Frames this deep are kept; deeper ones are cut from the root side
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename.replace('\\', '/')
+    if 'site-packages/' in filename:
+        filename = filename.split('site-packages/', 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    # Semicolons separate frames in the collapsed format
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ',')
+
+
+def collapse_stack(frame) -> str:
+    """Return a frame's stack as root-first, semicolon-separated labels."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    """Samples collected for one request thread."""
+
+    def __init__(self, thread_id: int, forced: bool):
+        self.thread_id = thread_id
+        self.forced = forced
+        self.started = time.perf_counter()
+        self.samples = Counter()
+
+
+class RequestProfiler:
+    """Sampling profiler for request threads with a ring of saved profiles.
+
+    Requests are profiled when they carry the configured token in the
+    X-MarkForge-Profile header, or, with a slow threshold set, always, in
+    which case the profile is only saved if the request was slower than
+    the threshold. Without a token or threshold nothing is sampled.
+    """
+
+    def __init__(self, directory: str, token: str = None, slow_ms: float = 0,
+                 interval_ms: float = SAMPLE_INTERVAL_MS, keep: int = MAX_PROFILES):
+        self.directory = directory
+        self.token = token or None
+        self.slow_ms = slow_ms
+        self.interval = max(interval_ms, 1) / 1000
+        self.keep = max(1, keep)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler = None
+        self.saved = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token or self.slow_ms > 0)
+
+    def begin(self, header_value: str = None):
+        """Start profiling the current thread if this request qualifies."""
+        forced = self.token is not None and header_value == self.token
+        if not forced and self.slow_ms <= 0:
+            return None
+        profile = Profile(threading.get_ident(), forced)
+        with self._lock:
+            self._active[profile.thread_id] = profile
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name='markforge-profiler', daemon=True)
+                self._sampler.start()
+        self._wakeup.set()
+        return profile
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+                if not active:
+                    self._wakeup.clear()
+            if not active:
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for profile in active:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.samples[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def finish(self, profile: Profile, endpoint: str) -> str:
+        """Stop profiling; save and return the profile's file name if kept."""
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+        elapsed_ms = (time.perf_counter() - profile.started) * 1000
+        if not profile.forced and elapsed_ms < self.slow_ms:
+            return None
+        if not profile.samples:
+            return None
+        try:
+            return self._save(profile, endpoint, elapsed_ms)
+        except OSError as e:
+            print(f"Profile save failed: {e}")
+            return None
+
+    def _save(self, profile: Profile, endpoint: str, elapsed_ms: float) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        name = f'{stamp}-{endpoint or "unknown"}-{elapsed_ms:.0f}ms-{os.getpid()}.collapsed'
+        tmp_path = os.path.join(self.directory, f'.{name}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for stack, count in profile.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self.saved += 1
+        self._trim()
+        return name
+
+    def _trim(self) -> None:
+        """Delete the oldest profiles beyond the ring size."""
+        try:
+            entries = [
+                entry for entry in os.scandir(self.directory)
+                if entry.name.endswith('.collapsed')
+            ]
+        except OSError:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:-self.keep]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = len(self._active)
+        return {
+            'enabled': self.enabled,
+            'slow_ms': self.slow_ms,
+            'interval_ms': self.interval * 1000,
+            'active': active,
+            'saved': self.saved,
+            'keep': self.keep,
+            'directory': self.directory,
+        }
@@ -0,0 +1,173 @@
+"""
+MarkForge - Markdown renderer pool
+Reusable, thread-safe pool of pre-built markdown.Markdown instances.
+"""
+
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import markdown
+
+from cache import config_fingerprint
+
+# Extensions shared by the Flask server and the Gradio web app
+MARKDOWN_EXTENSIONS = [
+    'tables',
+    'fenced_code',
+    'code_highlight',
+    'toc',
+    'nl2br',
+    'sane_lists',
+]
+
+# code_highlight is codehilite with cached Pygments lexers and output.
+# MARKFORGE_GUESS_LANG=0 stops guessing languages of unlabeled blocks.
+MARKDOWN_EXTENSION_CONFIGS = {
+    'code_highlight': {
+        'css_class': 'codehilite',
+        'linenums': False,
+        'guess_lang': os.environ.get('MARKFORGE_GUESS_LANG', '1') != '0',
+    }
+}
+
+# Match the gunicorn thread count (--threads 8) so every request thread
+# can hold a renderer without blocking.
+DEFAULT_POOL_SIZE = int(os.environ.get('MARKFORGE_RENDER_POOL_SIZE', 8))
+
+
+class RendererPool:
+    """Thread-safe pool of markdown.Markdown instances reset between uses."""
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, prebuild: bool = True,
+                 extensions=None, extension_configs=None):
+        self.size = max(1, size)
+        self.extensions = list(extensions or MARKDOWN_EXTENSIONS)
+        self.extension_configs = dict(extension_configs or MARKDOWN_EXTENSION_CONFIGS)
+        # Identifies the rendering configuration in cache keys
+        self.fingerprint = config_fingerprint(
+            [markdown.__version__, self.extensions, self.extension_configs]
+        )
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+        if prebuild:
+            for _ in range(self.size):
+                with self._lock:
+                    self._created += 1
+                self._idle.put(self._build())
+
+    def _build(self) -> markdown.Markdown:
+        """Create a new renderer in a slot already counted in _created."""
+        try:
+            return markdown.Markdown(
+                extensions=self.extensions,
+                extension_configs=self.extension_configs,
+            )
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _free_slot(self) -> None:
+        """Give up a renderer's slot and wake a waiting acquire to build anew."""
+        with self._lock:
+            self._created -= 1
+        # None in the idle queue tells a waiter the pool has room again
+        self._idle.put(None)
+
+    def acquire(self) -> markdown.Markdown:
+        """Take a renderer from the pool, building or waiting if none are idle."""
+        while True:
+            try:
+                md = self._idle.get_nowait()
+            except queue.Empty:
+                # Check and claim a slot in one step so at most size are built
+                with self._lock:
+                    can_build = self._created < self.size
+                    if can_build:
+                        self._created += 1
+                        self.misses += 1
+                    else:
+                        self.waits += 1
+                if can_build:
+                    return self._build()
+                md = self._idle.get()
+            else:
+                if md is not None:
+                    with self._lock:
+                        self.hits += 1
+            if md is not None:
+                return md
+
+    def release(self, md: markdown.Markdown) -> None:
+        """Reset a renderer and return it to the pool."""
+        try:
+            md.reset()
+        except Exception as e:
+            # A renderer that cannot be reset is dropped and rebuilt later
+            print(f"Renderer reset failed, discarding instance: {e}")
+            self._free_slot()
+            return
+        self._idle.put(md)
+
+    def fingerprint_for(self, guess_lang: bool = None) -> str:
+        """Fingerprint of the configuration a render with this override uses."""
+        default = self.extension_configs.get('code_highlight', {}).get('guess_lang', True)
+        if guess_lang is None or bool(guess_lang) == default:
+            return self.fingerprint
+        return config_fingerprint([self.fingerprint, 'guess_lang', bool(guess_lang)])
+
+    @contextmanager
+    def renderer(self, guess_lang: bool = None, guess_budget_ms: float = None,
+                 guess_max_blocks: int = None):
+        """Context manager yielding a pooled renderer.
+
+        guess_lang overrides language guessing for unlabeled code blocks,
+        guess_budget_ms its time budget and guess_max_blocks the number of
+        blocks guessed, for this use only; None keeps the configured default.
+        """
+        md = self.acquire()
+        md.guess_lang = guess_lang
+        md.guess_budget_ms = guess_budget_ms
+        md.guess_max_blocks = guess_max_blocks
+        try:
+            yield md
+        finally:
+            self.release(md)
+
+    def convert(self, markdown_text: str, guess_lang: bool = None, guess_budget_ms: float = None,
+                guess_max_blocks: int = None) -> str:
+        """Convert Markdown to HTML using a pooled renderer."""
+        with self.renderer(guess_lang, guess_budget_ms, guess_max_blocks) as md:
+            return md.convert(markdown_text)
+
+    def stats(self) -> dict:
+        """Return pool usage counters."""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'idle': self._idle.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+            }
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_renderer_pool() -> RendererPool:
+    """Return the process-wide renderer pool, creating it on first use."""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = RendererPool()
+    return _default_pool
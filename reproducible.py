@@ -0,0 +1,116 @@
+"""
+MarkForge - Reproducible PDF output
+With MARKFORGE_PDF_REPRODUCIBLE=1 (off by default), identical input renders to
+byte-identical PDFs, across runs and across processes. Creation and
+modification dates are pinned to SOURCE_DATE_EPOCH (2000-01-01 if unset)
+and document IDs are derived from the content.
+"""
+
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+
+REPRODUCIBLE = os.environ.get('MARKFORGE_PDF_REPRODUCIBLE', '0') == '1'
+# ReportLab's own default for invariant output
+DEFAULT_SOURCE_DATE = 946684800
+
+# Metadata Chromium writes uncompressed: Info dictionary dates, XMP dates
+# and UUIDs, and the trailer /ID
+PDF_DATE_RE = re.compile(rb'/(?:CreationDate|ModDate)\s*\((D:[^)]*)\)')
+XMP_DATE_RE = re.compile(rb'<(xmp:CreateDate|xmp:ModifyDate|xmp:MetadataDate)>([^<]*)</\1>')
+XMP_UUID_RE = re.compile(rb'uuid:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+TRAILER_ID_RE = re.compile(rb'/ID\s*\[\s*<([0-9a-fA-F]+)>\s*<([0-9a-fA-F]+)>\s*\]')
+
+_pinned = False
+_pin_lock = threading.Lock()
+
+
+def source_date() -> int:
+    """Timestamp written into reproducible PDFs."""
+    try:
+        return int(os.environ.get('SOURCE_DATE_EPOCH', '').strip())
+    except ValueError:
+        return DEFAULT_SOURCE_DATE
+
+
+def pin_xhtml2pdf() -> None:
+    """Make xhtml2pdf output reproducible for the rest of this process.
+
+    Puts ReportLab into invariant mode, which fixes the timestamp (ReportLab
+    reads SOURCE_DATE_EPOCH itself), derives the document ID from the
+    content and writes dictionaries in sorted order; the object numbering
+    already follows the document. xhtml2pdf names embedded images after
+    hash() of their bytes, which differs between processes, so
+    PmlImageReader.__str__ is wrapped once per process to use a digest.
+    """
+    global _pinned
+    with _pin_lock:
+        if _pinned:
+            return
+        _pinned = True
+
+    from reportlab import rl_config
+    rl_config.invariant = 1
+
+    from xhtml2pdf.xhtml2pdf_reportlab import PmlImageReader
+    image_name = PmlImageReader.__str__
+
+    def stable_image_name(self):
+        source = getattr(self, 'fileName', None)
+        if isinstance(source, io.BytesIO):
+            data = source.getvalue()
+        elif hasattr(source, 'tobytes'):
+            # PIL image
+            data = source.tobytes()
+        else:
+            return image_name(self)
+        return f'PmlImageObject_{hashlib.sha256(data).hexdigest()[:32]}'
+
+    PmlImageReader.__str__ = stable_image_name
+
+
+def _pin_digits(value: bytes, digits: bytes) -> bytes:
+    """Overwrite the digits of a date in order, keeping its format and length."""
+    out = bytearray(value)
+    index = 0
+    for position, char in enumerate(out):
+        if 48 <= char <= 57:
+            out[position] = digits[index] if index < len(digits) else 48
+            index += 1
+    return bytes(out)
+
+
+def _fill_hex(value: bytes, digest: bytes) -> bytes:
+    """Overwrite the hex digits of value from digest, keeping separators."""
+    out = bytearray(value)
+    index = 0
+    for position, char in enumerate(out):
+        if chr(char) in '0123456789abcdefABCDEF':
+            out[position] = digest[index % len(digest)]
+            index += 1
+    return bytes(out)
+
+
+def normalize_pdf(data: bytes) -> bytes:
+    """Pin the dates and IDs of a PDF from another backend, such as Chromium.
+
+    Every replacement has the same length as what it replaces, so the
+    cross-reference offsets stay valid.
+    """
+    digits = time.strftime('%Y%m%d%H%M%S', time.gmtime(source_date())).encode('ascii')
+
+    data = PDF_DATE_RE.sub(lambda m: m.group(0).replace(m.group(1), _pin_digits(m.group(1), digits)), data)
+    data = XMP_DATE_RE.sub(
+        lambda m: b'<%s>%s</%s>' % (m.group(1), _pin_digits(m.group(2), digits), m.group(1)), data
+    )
+
+    def replace_ids(data: bytes, digest: bytes) -> bytes:
+        data = XMP_UUID_RE.sub(lambda m: b'uuid:' + _fill_hex(m.group(0)[5:], digest), data)
+        return TRAILER_ID_RE.sub(lambda m: b'/ID' + _fill_hex(m.group(0)[3:], digest), data)
+
+    # IDs derived from the document with its random parts blanked out
+    digest = hashlib.sha256(replace_ids(data, b'0')).hexdigest().encode('ascii')
+    return replace_ids(data, digest)
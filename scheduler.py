@@ -0,0 +1,161 @@
+"""
+MarkForge - Priority scheduling of PDF renders
+Renders wait for one of a fixed number of slots. When a slot frees up it goes
+to the waiting render with the best rank: interactive downloads before bulk
+exports, and within a class, clients inside their fair share before clients
+that have used up their token bucket. Waiting improves a render's rank, so
+bulk work still gets slots while interactive traffic keeps arriving.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+
+import metrics
+
+# Rank of a fresh render of each class; lower runs first
+PRIORITIES = {'interactive': 0.0, 'bulk': 1.0}
+# Added to the rank of a client that is over its fair share
+OVER_SHARE_PENALTY = 0.5
+# Seconds of waiting that improve a render's rank by one class
+AGING_SECONDS = float(os.environ.get('MARKFORGE_PDF_AGING_SECONDS', 10))
+# Per-client token bucket: renders per second, and the burst allowed
+CLIENT_RATE = float(os.environ.get('MARKFORGE_PDF_CLIENT_RATE', 0.5))
+CLIENT_BURST = float(os.environ.get('MARKFORGE_PDF_CLIENT_BURST', 10))
+# Buckets kept for the most recently seen clients only
+MAX_CLIENTS = 4096
+
+# (priority, client) of the renders started in this context
+_request = ContextVar('markforge_pdf_priority', default=('interactive', ''))
+
+
+@contextmanager
+def bind(priority: str, client: str = ''):
+    """Schedule renders started in this context with the given class and client."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r}")
+    token = _request.set((priority, client))
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+class TokenBucket:
+    """Refills at rate tokens per second up to burst."""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class _Waiter:
+    __slots__ = ('priority', 'client', 'in_share', 'arrived', 'seq')
+
+    def __init__(self, priority: str, client: str, in_share: bool, arrived: float, seq: int):
+        self.priority = priority
+        self.client = client
+        self.in_share = in_share
+        self.arrived = arrived
+        self.seq = seq
+
+    def rank(self, now: float, aging_seconds: float) -> tuple:
+        rank = PRIORITIES[self.priority] + (0.0 if self.in_share else OVER_SHARE_PENALTY)
+        return rank - (now - self.arrived) / aging_seconds, self.seq
+
+
+class PriorityScheduler:
+    """Hands out render slots by class, fair share and waiting time."""
+
+    def __init__(self, slots: int, aging_seconds: float = AGING_SECONDS,
+                 client_rate: float = CLIENT_RATE, client_burst: float = CLIENT_BURST):
+        self.slots = max(1, slots)
+        self.aging_seconds = max(aging_seconds, 0.001)
+        self.client_rate = client_rate
+        self.client_burst = max(client_burst, 1)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._active = 0
+        self._buckets = OrderedDict()
+        self._seq = count()
+        self._counts = {name: {'scheduled': 0, 'over_share': 0} for name in PRIORITIES}
+
+    def _in_share(self, client: str, now: float) -> bool:
+        if not client or self.client_rate <= 0:
+            return True
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.client_burst, now)
+            if len(self._buckets) > MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take(self.client_rate, self.client_burst, now)
+
+    def _next(self, now: float) -> _Waiter:
+        return min(self._waiting, key=lambda waiter: waiter.rank(now, self.aging_seconds))
+
+    @contextmanager
+    def slot(self, priority: str = None, client: str = None):
+        """Hold a render slot for the block, waiting for one if needed.
+
+        priority and client default to those bound to the current context.
+        """
+        bound_priority, bound_client = _request.get()
+        priority = priority or bound_priority
+        client = bound_client if client is None else client
+        arrived = time.monotonic()
+        with self._cond:
+            waiter = _Waiter(priority, client, self._in_share(client, arrived), arrived, next(self._seq))
+            counts = self._counts[priority]
+            counts['scheduled'] += 1
+            counts['over_share'] += not waiter.in_share
+            if self._active >= self.slots or self._waiting:
+                self._waiting.append(waiter)
+                try:
+                    while self._active >= self.slots or self._next(time.monotonic()) is not waiter:
+                        self._cond.wait()
+                finally:
+                    self._waiting.remove(waiter)
+                    # Another slot may still be free for the next in line
+                    self._cond.notify_all()
+            self._active += 1
+        started = time.monotonic()
+        metrics.PDF_WAIT_SECONDS.observe(started - arrived, priority=priority)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+            metrics.PDF_LATENCY_SECONDS.observe(time.monotonic() - arrived, priority=priority)
+
+    def stats(self) -> dict:
+        """Return slot usage, waiting renders and counters per class."""
+        with self._cond:
+            waiting = {name: 0 for name in PRIORITIES}
+            for waiter in self._waiting:
+                waiting[waiter.priority] += 1
+            return {
+                'slots': self.slots,
+                'active': self._active,
+                'clients': len(self._buckets),
+                'classes': {
+                    name: {'waiting': waiting[name], **counts}
+                    for name, counts in self._counts.items()
+                },
+            }
@@ -4,34 +4,166 @@ MarkForge - Professional Document Converter
 Enterprise-grade document conversion by Zorost Intelligence
 """
 
-from flask import Flask, render_template, request, jsonify, Response
-import markdown
-from markitdown import MarkItDown
+from flask import Flask, g, render_template, request, jsonify, Response, send_file, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.wsgi import wrap_file
 import tempfile
+import io
 import os
+import multiprocessing
+import threading
+import time
+import zipfile
+from importlib import import_module
+from importlib.metadata import PackageNotFoundError, version as package_version
+from importlib.util import find_spec
 from pathlib import Path
 
+from admission import AdmissionGate, Overloaded, markdown_cost, upload_cost
+from batch import documents_from_json, documents_from_zip, stream_pdf_zip
+from cache import DiskCache, RenderCache, config_fingerprint, content_key, default_cache_dir, stream_digest
+from code_highlight import GUESS_MAX_BLOCKS, get_highlighter, track_degraded
+from doc_stream import iter_pdf_pages, join_pages, split_sections, sse_event
+import metrics
+from pdf_jobs import PDFJobQueue, QueueFull
+from pdf_styles import PAGE_SIZES, get_pdf_style
+from pdf_tables import CHUNK_ROWS, LARGE_TABLE_ROWS, split_large_tables
+from pdf_workers import DEFAULT_PROCESSES, PDFProcessPool, render_xhtml2pdf_to
+from preview_blocks import BlockRenderer
+from profiler import RequestProfiler
+from render_pool import get_renderer_pool
+from reproducible import REPRODUCIBLE, normalize_pdf, source_date
+import scheduler
+from scheduler import PriorityScheduler
+from uploads import UploadRequest, detach_upload, seekable_upload
+
+# The PDF and document backends take seconds to import and previews need
+# none of them, so they are only looked up here and imported on first use
+# (or by the warm-up thread below)
+
 # xhtml2pdf for PDF generation (pure Python, works in bundled apps)
-try:
-    from xhtml2pdf import pisa
-    import io
-    HAS_XHTML2PDF = True
-except ImportError:
-    HAS_XHTML2PDF = False
+HAS_XHTML2PDF = find_spec('xhtml2pdf') is not None
+if not HAS_XHTML2PDF:
     print("xhtml2pdf not available.")
 
 # Playwright is optional - used for high-quality PDF generation (development only)
-try:
-    from playwright.sync_api import sync_playwright
-    HAS_PLAYWRIGHT = True
-except ImportError:
-    HAS_PLAYWRIGHT = False
+HAS_PLAYWRIGHT = find_spec('playwright') is not None
+_browser_pool = None
+
+
+def backend_version(name: str) -> str:
+    """Installed version of a backend package, without importing it if possible."""
+    try:
+        return package_version(name)
+    except PackageNotFoundError:
+        # Frozen desktop builds may ship without package metadata
+        return getattr(import_module(name), '__version__', '')
+
+
+def get_browser_pool():
+    """The worker's Playwright browser pool, importing Playwright on first use."""
+    global _browser_pool
+    if _browser_pool is None:
+        from browser_pool import get_browser_pool as default_browser_pool
+        _browser_pool = default_browser_pool()
+    return _browser_pool
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max upload
 
-# Initialize MarkItDown converter
-md_converter = MarkItDown()
+# Reverse proxies in front of the app whose X-Forwarded-For entries are
+# trusted. With the default of 0, remote_addr is the connecting peer and
+# clients cannot pick their own address.
+TRUSTED_PROXIES = int(os.environ.get('MARKFORGE_TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+# MarkItDown converter, created on first use
+_md_converter = None
+_md_converter_lock = threading.Lock()
+
+
+def get_md_converter():
+    """The shared MarkItDown converter, importing MarkItDown on first use."""
+    global _md_converter
+    if _md_converter is None:
+        with _md_converter_lock:
+            if _md_converter is None:
+                from markitdown import MarkItDown
+                _md_converter = MarkItDown()
+    return _md_converter
+
+# pdfminer (markitdown[pdf]) enables page-by-page streaming of PDFs
+HAS_PDFMINER = find_spec('pdfminer') is not None
+
+# Document conversion results cached on disk by upload content hash. The
+# directory is shared by all gunicorn workers; including the MarkItDown
+# version in the key invalidates entries after an upgrade.
+DOC_CACHE_BYTES = int(os.environ.get('MARKFORGE_DOC_CACHE_BYTES', 512 * 1024 * 1024))
+DOC_CACHE_VERSION = backend_version('markitdown') if os.environ.get('MARKFORGE_DOC_CACHE_VERSIONED', '1') != '0' else ''
+doc_cache = None
+if DOC_CACHE_BYTES > 0:
+    doc_cache = DiskCache(
+        os.environ.get('MARKFORGE_DOC_CACHE_DIR', default_cache_dir('doc-cache')),
+        DOC_CACHE_BYTES
+    )
+
+# Rendered PDFs cached on disk by a hash of everything that shapes them and
+# shared by all gunicorn workers; the hash doubles as the response ETag
+PDF_CACHE_BYTES = int(os.environ.get('MARKFORGE_PDF_CACHE_BYTES', 256 * 1024 * 1024))
+pdf_cache = None
+if PDF_CACHE_BYTES > 0:
+    pdf_cache = DiskCache(
+        os.environ.get('MARKFORGE_PDF_CACHE_DIR', default_cache_dir('pdf-cache')),
+        PDF_CACHE_BYTES
+    )
+
+# Pre-built Markdown renderers shared by all request threads
+renderer_pool = get_renderer_pool()
+
+# Optional process pool for xhtml2pdf (MARKFORGE_PDF_PROCESSES > 0). Only the
+# main process creates it: spawned children re-import this module.
+pdf_process_pool = None
+if HAS_XHTML2PDF and DEFAULT_PROCESSES > 0 and multiprocessing.current_process().name == 'MainProcess':
+    pdf_process_pool = PDFProcessPool(DEFAULT_PROCESSES)
+    threading.Thread(target=pdf_process_pool.warm, daemon=True).start()
+
+# Opt-in request profiler: requests sending MARKFORGE_PROFILE_TOKEN in the
+# X-MarkForge-Profile header, or slower than MARKFORGE_PROFILE_SLOW_MS
+request_profiler = RequestProfiler(
+    os.environ.get('MARKFORGE_PROFILE_DIR', default_cache_dir('profiles')),
+    token=os.environ.get('MARKFORGE_PROFILE_TOKEN'),
+    slow_ms=float(os.environ.get('MARKFORGE_PROFILE_SLOW_MS', 0))
+)
+
+# Share metric snapshots with the other gunicorn workers
+if multiprocessing.current_process().name == 'MainProcess':
+    metrics.REGISTRY.start()
+
+# Preview cache: per-worker LRU, optionally backed by a directory shared
+# by all gunicorn workers (set MARKFORGE_PREVIEW_CACHE_DIR to enable)
+preview_cache = RenderCache(
+    max_bytes=int(os.environ.get('MARKFORGE_PREVIEW_CACHE_BYTES', 32 * 1024 * 1024)),
+    shared_dir=os.environ.get('MARKFORGE_PREVIEW_CACHE_DIR'),
+    shared_max_bytes=int(os.environ.get('MARKFORGE_PREVIEW_CACHE_DIR_BYTES', 256 * 1024 * 1024)),
+)
+
+# Block-level renderer for incremental previews, sharing the same cache
+block_renderer = BlockRenderer(renderer_pool, preview_cache)
+
+# Admission control per traffic class and gunicorn worker. Running and
+# queued PDF, document and batch requests each hold a request thread (a batch
+# for its whole ZIP stream), so their concurrency plus queue stays below
+# --threads 8 and previews always find a thread. PDFs run one per process
+# of the PDF pool, or one at a time when xhtml2pdf renders in-thread.
+admission_gates = {
+    'preview': AdmissionGate.from_env('preview', concurrency=4, max_queue=16, slo_ms=1000),
+    'pdf': AdmissionGate.from_env('pdf', concurrency=max(1, DEFAULT_PROCESSES), max_queue=1, slo_ms=30000),
+    'docs': AdmissionGate.from_env('docs', concurrency=1, max_queue=0, slo_ms=60000),
+    'batch': AdmissionGate.from_env('batch', concurrency=1, max_queue=0, slo_ms=600000),
+}
 
 # Professional PDF CSS - Compatible with xhtml2pdf (no external dependencies)
 PDF_CSS = """
@@ -211,6 +343,22 @@ tr {
     break-inside: avoid !important;
 }
 
+/* Large tables arrive split into chunks (pdf_tables.py) that may break
+   across pages and join up into one table */
+.large-table {
+    margin: 1em 0;
+}
+
+table.table-chunk {
+    width: 100%;
+    margin: 0;
+}
+
+table.table-chunk, table.table-chunk tbody, table.table-chunk tr {
+    page-break-inside: auto !important;
+    break-inside: auto !important;
+}
+
 th {
     background: #374151;
     color: white;
@@ -304,107 +452,403 @@ p, li, blockquote, td {
 }
 """
 
-
-def convert_markdown_to_html(markdown_text: str) -> str:
-    """Convert Markdown to HTML with full extension support."""
-    md = markdown.Markdown(
-        extensions=[
-            'tables',
-            'fenced_code',
-            'codehilite',
-            'toc',
-            'nl2br',
-            'sane_lists',
-        ],
-        extension_configs={
-            'codehilite': {
-                'css_class': 'codehilite',
-                'linenums': False,
-                'guess_lang': True,
-            }
-        }
+# Everything besides the Markdown, page size and renderer configuration that
+# shapes a PDF; part of the PDF cache key, so changing it invalidates entries
+PDF_PIPELINE_VERSION = config_fingerprint([
+    PDF_CSS, LARGE_TABLE_ROWS, CHUNK_ROWS,
+    f"xhtml2pdf {backend_version('xhtml2pdf')}" if HAS_XHTML2PDF else 'playwright',
+    f'reproducible {source_date()} guess {GUESS_MAX_BLOCKS}' if REPRODUCIBLE else 'timestamped',
+])
+
+
+# Time-budgeted language guessing depends on how fast this render happens
+# to run, so reproducible PDFs bound it by a number of blocks instead of
+# time; with GUESS_MAX_BYTES per block, the cost stays bounded
+PDF_GUESS_OPTIONS = {'guess_budget_ms': float('inf'), 'guess_max_blocks': GUESS_MAX_BLOCKS} if REPRODUCIBLE else {}
+
+
+def convert_markdown_to_html(markdown_text: str, guess_lang: bool = None,
+                             guess_budget_ms: float = None, guess_max_blocks: int = None) -> str:
+    """Convert Markdown to HTML with full extension support.
+
+    guess_lang turns language guessing for unlabeled code blocks on or off
+    for this render, guess_budget_ms sets its time budget and
+    guess_max_blocks caps the blocks guessed; None uses the configured
+    default.
+    """
+    with metrics.stage('markdown'):
+        return renderer_pool.convert(markdown_text, guess_lang, guess_budget_ms, guess_max_blocks)
+
+
+def render_preview_html(markdown_text: str, guess_lang: bool = None) -> str:
+    """Convert Markdown to HTML, reusing cached output for repeated content."""
+    key = content_key(markdown_text, renderer_pool.fingerprint_for(guess_lang))
+    html_content = preview_cache.get(key)
+    if html_content is None:
+        with track_degraded() as status:
+            html_content = convert_markdown_to_html(markdown_text, guess_lang)
+        if not status.degraded:
+            preview_cache.set(key, html_content)
+    return html_content
+
+
+def build_pdf_document(markdown_text: str, page_size: str = "A4", guess_lang: bool = None) -> str:
+    """Build the complete HTML document that is rendered to PDF."""
+    html_content = split_large_tables(
+        convert_markdown_to_html(markdown_text, guess_lang, **PDF_GUESS_OPTIONS)
     )
-    return md.convert(markdown_text)
-
-
-def generate_pdf_bytes(markdown_text: str, page_size: str = "A4") -> bytes:
-    """Generate PDF from Markdown using xhtml2pdf or Playwright."""
-    html_content = convert_markdown_to_html(markdown_text)
     
-    # Build complete HTML document with xhtml2pdf-compatible CSS
-    full_html = f"""<!DOCTYPE html>
+    # Build complete HTML document with xhtml2pdf-compatible CSS, prepared
+    # once per page size so workers can reuse the parsed stylesheet
+    return f"""<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
-    <style>{PDF_CSS}</style>
+    {get_pdf_style(PDF_CSS, page_size).style_tags}
 </head>
 <body>
 {html_content}
 </body>
 </html>"""
+
+
+# PDFs up to this size stay in memory; larger ones spill to a temp file
+PDF_SPOOL_BYTES = int(os.environ.get('MARKFORGE_PDF_SPOOL_BYTES', 4 * 1024 * 1024))
+PDF_CHUNK_BYTES = 64 * 1024
+
+
+def generate_pdf_bytes(markdown_text: str, page_size: str = "A4") -> bytes:
+    """Generate PDF from Markdown using xhtml2pdf or Playwright."""
+    return render_pdf_document(build_pdf_document(markdown_text, page_size), page_size)
+
+
+def generate_pdf_file(markdown_text: str, page_size: str = "A4", guess_lang: bool = None):
+    """Generate a PDF into a spooled temp file.
+
+    Returns (file, size) with the file rewound; the caller closes it.
+    """
+    pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+    try:
+        render_pdf_document_to(build_pdf_document(markdown_text, page_size, guess_lang), pdf_file, page_size)
+    except Exception:
+        pdf_file.close()
+        raise
+    size = pdf_file.tell()
+    pdf_file.seek(0)
+    return pdf_file, size
+
+
+def pdf_cache_key(markdown_text: str, page_size: str = "A4", guess_lang: bool = None) -> str:
+    """Content address of a PDF: Markdown, page size, stylesheet, backend, renderer."""
+    return content_key(markdown_text, str(page_size), PDF_PIPELINE_VERSION,
+                       renderer_pool.fingerprint_for(guess_lang))
+
+
+def generate_cached_pdf_file(markdown_text: str, page_size: str = "A4", guess_lang: bool = None,
+                             key: str = None):
+    """Like generate_pdf_file, but served from and stored in the PDF cache.
+
+    Returns (file, size, etag). etag is the cache key, or None for a PDF
+    whose highlighting was degraded by the guessing budget; such a PDF is
+    neither cached nor labelled as the document's canonical rendering.
+    """
+    key = key or pdf_cache_key(markdown_text, page_size, guess_lang)
+    if pdf_cache is not None:
+        cached = pdf_cache.open(key)
+        if cached is not None:
+            return (*cached, key)
+    # Only renders are admission-controlled; cache hits are always served
+    with admission_gates['pdf'].admit(markdown_cost(markdown_text)), \
+            scheduler.bind(request_priority(), request_client()), \
+            track_degraded() as status:
+        pdf_file, size = generate_pdf_file(markdown_text, page_size, guess_lang)
+    if status.degraded:
+        return pdf_file, size, None
+    if pdf_cache is not None:
+        try:
+            pdf_cache.set_file(key, pdf_file)
+        except OSError as e:
+            print(f"PDF cache write failed: {e}")
+        pdf_file.seek(0)
+    return pdf_file, size, key
+
+
+def request_client() -> str:
+    """Fair-share identity of the caller: its IP address.
+
+    Nothing a client sends in headers is used, so it cannot pick a fresh
+    identity per request; see MARKFORGE_TRUSTED_PROXIES for proxies.
+    """
+    return 'ip:' + (request.remote_addr or '')
+
+
+def request_priority(default: str = 'interactive') -> str:
+    """Scheduling class of the request's renders.
+
+    Clients can lower their own priority with X-MarkForge-Priority: bulk
+    but never raise it.
+    """
+    if request.headers.get('X-MarkForge-Priority', '').strip().lower() == 'bulk':
+        return 'bulk'
+    return default
+
+
+def not_modified(etag: str):
+    """A 304 response if the request's If-None-Match covers etag, else None."""
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    return None
+
+
+def render_pdf_document(full_html: str, page_size: str = "A4",
+                        process_pool: PDFProcessPool = None) -> bytes:
+    """Render a complete HTML document to PDF bytes."""
+    result = io.BytesIO()
+    render_pdf_document_to(full_html, result, page_size, process_pool)
+    return result.getvalue()
+
+
+def render_pdf_document_to(full_html: str, dest, page_size: str = "A4",
+                           process_pool: PDFProcessPool = None) -> None:
+    """Render a complete HTML document to PDF, writing into a binary file object.
+
+    Waits for a render slot from pdf_scheduler, in the class and on behalf
+    of the client bound with scheduler.bind() (interactive by default).
+    """
+    with pdf_scheduler.slot():
+        _render_with_backends(full_html, dest, page_size, process_pool or pdf_process_pool)
+
+
+def _render_with_backends(full_html: str, dest, page_size: str, process_pool: PDFProcessPool) -> None:
+    """Render with xhtml2pdf, falling back to Playwright."""
+    # Free-form page sizes would make unbounded metric label values
+    size_label = page_size if page_size in PAGE_SIZES else 'other'
     
     # Try xhtml2pdf first (pure Python, works in bundled apps)
     if HAS_XHTML2PDF:
         try:
-            result = io.BytesIO()
-            pisa_status = pisa.CreatePDF(
-                src=full_html,
-                dest=result,
-                encoding='UTF-8'
-            )
-            if pisa_status.err:
-                raise Exception(f"xhtml2pdf error: {pisa_status.err}")
-            return result.getvalue()
+            with metrics.stage('layout', page_size=size_label, backend='xhtml2pdf'):
+                if process_pool is not None:
+                    dest.write(process_pool.render(full_html))
+                else:
+                    render_xhtml2pdf_to(full_html, dest)
+            return
+        except TimeoutError:
+            # The pool killed a runaway render; Chromium would only run it again
+            raise
         except Exception as e:
             print(f"xhtml2pdf error: {e}")
-            # Fall through to Playwright if xhtml2pdf fails
+            metrics.PDF_FALLBACKS.inc(endpoint=metrics.current_endpoint())
+            # Discard partial output and fall through to Playwright
+            dest.seek(0)
+            dest.truncate()
     
-    # Try Playwright as fallback (for development with browser rendering)
+    # Try Playwright as fallback (persistent browser pool, one per worker)
     if HAS_PLAYWRIGHT:
-        with sync_playwright() as p:
-            browser = p.chromium.launch()
-            page = browser.new_page()
-            
-            page.set_content(full_html, wait_until='networkidle')
-            
-            pdf_bytes = page.pdf(
-                format=page_size if page_size in ['A4', 'A3', 'A5', 'Letter', 'Legal'] else 'A4',
-                margin={
+        with metrics.stage('playwright', page_size=size_label, backend='playwright'):
+            pdf_bytes = get_browser_pool().render_pdf(full_html, {
+                'format': page_size if page_size in ['A4', 'A3', 'A5', 'Letter', 'Legal'] else 'A4',
+                'margin': {
                     'top': '20mm',
                     'right': '18mm',
                     'bottom': '20mm',
                     'left': '18mm'
                 },
-                print_background=True,
-                prefer_css_page_size=True
-            )
-            
-            browser.close()
-        
-        return pdf_bytes
+                'print_background': True,
+                'prefer_css_page_size': True
+            })
+            dest.write(normalize_pdf(pdf_bytes) if REPRODUCIBLE else pdf_bytes)
+        return
     
     raise Exception("No PDF generation library available. Please install xhtml2pdf.")
 
 
+def overloaded_response(e: Overloaded):
+    """503 for a request refused by admission control."""
+    response = jsonify({'error': str(e), 'reason': e.reason, 'success': False})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+
+def pdf_file_response(pdf_file, size: int, filename: str, etag: str = None) -> Response:
+    """Stream a generated PDF file in chunks, closing it when done."""
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Content-Length': size
+    }
+    if etag:
+        headers['ETag'] = f'"{etag}"'
+        if pdf_cache is not None:
+            # Where the same PDF can be fetched (and revalidated) with GET
+            headers['Content-Location'] = f'/api/pdf/{etag}'
+    return Response(
+        wrap_file(request.environ, pdf_file, PDF_CHUNK_BYTES),
+        mimetype='application/pdf',
+        direct_passthrough=True,
+        headers=headers
+    )
+
+
+def run_pdf_job(markdown_text: str, page_size: str, progress, client: str = '') -> bytes:
+    """Render a queued PDF job, reporting progress between pipeline stages."""
+    with metrics.bind_endpoint('pdf_job'), scheduler.bind('bulk', client):
+        progress('converting', 20)
+        full_html = build_pdf_document(markdown_text, page_size)
+        progress('rendering', 50)
+        return render_pdf_document(full_html, page_size)
+
+
+BATCH_MAX_DOCUMENTS = int(os.environ.get('MARKFORGE_BATCH_MAX_DOCUMENTS', 500))
+# Decompressed size limits for ZIP uploads, per document and in total
+BATCH_MAX_DOCUMENT_BYTES = int(os.environ.get('MARKFORGE_BATCH_MAX_DOCUMENT_BYTES', 5 * 1024 * 1024))
+BATCH_MAX_TOTAL_BYTES = int(os.environ.get('MARKFORGE_BATCH_MAX_TOTAL_BYTES', 100 * 1024 * 1024))
+BATCH_PROCESSES = int(os.environ.get('MARKFORGE_BATCH_PROCESSES', os.cpu_count() or 2))
+
+batch_process_pool = None
+_batch_pool_lock = threading.Lock()
+
+
+def get_batch_process_pool() -> PDFProcessPool:
+    """Process pool for batch conversions, created on the first batch."""
+    global batch_process_pool
+    if pdf_process_pool is not None:
+        return pdf_process_pool
+    with _batch_pool_lock:
+        if batch_process_pool is None:
+            batch_process_pool = PDFProcessPool(BATCH_PROCESSES)
+    return batch_process_pool
+
+
+# Render slots shared by interactive and bulk PDFs in this worker: one per
+# process of the pool that batches render in
+pdf_scheduler = PriorityScheduler(int(os.environ.get(
+    'MARKFORGE_PDF_SLOTS', pdf_process_pool.processes if pdf_process_pool else BATCH_PROCESSES
+)))
+
+
+# Background PDF jobs (state shared between workers through MARKFORGE_JOB_DIR)
+pdf_jobs = PDFJobQueue(
+    run_pdf_job,
+    os.environ.get('MARKFORGE_JOB_DIR', default_cache_dir('jobs'))
+)
+
+
+def warm_up_backends() -> None:
+    """Import the backends this worker renders with before a request needs them."""
+    start = time.perf_counter()
+    try:
+        if HAS_XHTML2PDF and pdf_process_pool is None:
+            # With a process pool, the children render and warm themselves
+            render_xhtml2pdf_to('<html><body><p>MarkForge</p><pre>code</pre></body></html>', io.BytesIO())
+        get_md_converter()
+    except Exception as e:
+        print(f"Backend warm-up failed: {e}")
+        return
+    print(f"Backends warmed up in {time.perf_counter() - start:.1f}s")
+
+
+# Warm up in the background once the worker can serve previews; set
+# MARKFORGE_WARM_UP=0 to import backends only when a request needs them
+if os.environ.get('MARKFORGE_WARM_UP', '1') != '0' and multiprocessing.current_process().name == 'MainProcess':
+    threading.Thread(target=warm_up_backends, name='markforge-warm-up', daemon=True).start()
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    g.metrics_token = metrics.set_endpoint(request.endpoint or 'unknown')
+    if request_profiler.enabled:
+        g.profile = request_profiler.begin(request.headers.get('X-MarkForge-Profile'))
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    start = g.get('metrics_start')
+    if start is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile_name = request_profiler.finish(profile, endpoint)
+        if profile_name:
+            response.headers['X-MarkForge-Profile-Id'] = profile_name
+    return response
+
+
+@app.teardown_request
+def reset_request_metrics(exc):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics.reset_endpoint(token)
+    # Requests that failed before after_request still stop sampling
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.finish(profile, request.endpoint)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expose pipeline timings and request counters to Prometheus."""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def index():
     """Serve the main application page."""
     return render_template('index.html')
 
 
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Report internal pool and cache counters."""
+    return jsonify({
+        'renderer_pool': renderer_pool.stats(),
+        'highlighter': get_highlighter().stats(),
+        'preview_cache': preview_cache.stats(),
+        # Only once a fallback render has started it
+        'browser_pool': _browser_pool.stats() if _browser_pool is not None else None,
+        'pdf_jobs': pdf_jobs.stats(),
+        'doc_cache': doc_cache.stats() if doc_cache else None,
+        'pdf_cache': pdf_cache.stats() if pdf_cache else None,
+        'pdf_process_pool': pdf_process_pool.stats() if pdf_process_pool else None,
+        'profiler': request_profiler.stats(),
+        'admission': {name: gate.stats() for name, gate in admission_gates.items()},
+        'pdf_scheduler': pdf_scheduler.stats(),
+        'success': True
+    })
+
+
 @app.route('/api/preview', methods=['POST'])
 def preview():
-    """Generate HTML preview of Markdown."""
+    """Generate HTML preview of Markdown.
+
+    With "incremental": true the response lists the document's block ids in
+    order and only includes HTML fragments for blocks not in "known".
+    "guess_lang": false skips language guessing for unlabeled code blocks.
+    """
     try:
         data = request.get_json()
         markdown_text = data.get('markdown', '')
+        incremental = bool(data.get('incremental', False))
+        guess_lang = data.get('guess_lang')
         
         if not markdown_text.strip():
+            if incremental:
+                return jsonify({'blocks': [], 'fragments': {}, 'incremental': True, 'success': True})
             return jsonify({'html': '', 'success': True})
         
-        html_content = convert_markdown_to_html(markdown_text)
+        with admission_gates['preview'].admit(markdown_cost(markdown_text)):
+            if incremental:
+                with metrics.stage('markdown'):
+                    result = block_renderer.render(markdown_text, data.get('known', []), guess_lang)
+                return jsonify({**result, 'incremental': True, 'success': True})
+            
+            html_content = render_preview_html(markdown_text, guess_lang)
         return jsonify({'html': html_content, 'success': True})
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
@@ -417,30 +861,33 @@ def convert():
         markdown_text = data.get('markdown', '')
         page_size = data.get('pageSize', 'A4')
         filename = data.get('filename', 'document.pdf')
+        guess_lang = data.get('guess_lang')
         
         if not markdown_text.strip():
             return jsonify({'error': 'No content provided'}), 400
         
-        # Generate PDF
-        pdf_bytes = generate_pdf_bytes(markdown_text, page_size)
+        key = pdf_cache_key(markdown_text, page_size, guess_lang)
+        unchanged = not_modified(key)
+        if unchanged is not None:
+            return unchanged
         
-        # Return as downloadable file
-        return Response(
-            pdf_bytes,
-            mimetype='application/pdf',
-            headers={
-                'Content-Disposition': f'attachment; filename="{filename}"',
-                'Content-Length': len(pdf_bytes)
-            }
-        )
+        # Generate PDF (or reuse a cached one) and stream it back
+        pdf_file, size, etag = generate_cached_pdf_file(markdown_text, page_size, guess_lang, key)
+        return pdf_file_response(pdf_file, size, filename, etag)
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/convert-base64', methods=['POST'])
 def convert_base64():
-    """Convert Markdown to PDF and return as base64 (for desktop app)."""
+    """Convert Markdown to PDF and return as base64.
+
+    Kept for older clients; the editor now downloads from /api/convert and
+    the desktop app saves through its export_pdf bridge without base64.
+    """
     import base64
     try:
         data = request.get_json()
@@ -450,13 +897,24 @@ def convert_base64():
         if not markdown_text.strip():
             return jsonify({'error': 'No content provided', 'success': False}), 400
         
-        # Generate PDF
-        pdf_bytes = generate_pdf_bytes(markdown_text, page_size)
+        key = pdf_cache_key(markdown_text, page_size)
+        unchanged = not_modified(key)
+        if unchanged is not None:
+            return unchanged
+        
+        # Generate PDF (or reuse a cached one)
+        pdf_file, _, etag = generate_cached_pdf_file(markdown_text, page_size, key=key)
+        with pdf_file:
+            pdf_base64 = base64.b64encode(pdf_file.read()).decode('utf-8')
         
         # Return as base64
-        pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
-        return jsonify({'pdf_base64': pdf_base64, 'success': True})
+        response = jsonify({'pdf_base64': pdf_base64, 'success': True})
+        if etag:
+            response.headers['ETag'] = f'"{etag}"'
+        return response
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
@@ -471,21 +929,155 @@ def download_pdf():
         if not markdown_text.strip():
             return "No content provided", 400
         
-        # Generate PDF
-        pdf_bytes = generate_pdf_bytes(markdown_text, page_size)
+        key = pdf_cache_key(markdown_text, page_size)
+        unchanged = not_modified(key)
+        if unchanged is not None:
+            return unchanged
         
-        # Return as downloadable file
-        return Response(
-            pdf_bytes,
-            mimetype='application/pdf',
+        # Generate PDF (or reuse a cached one) and stream it back
+        pdf_file, size, etag = generate_cached_pdf_file(markdown_text, page_size, key=key)
+        return pdf_file_response(pdf_file, size, 'document.pdf', etag)
+    
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return f"Error: {str(e)}", 500
+
+
+@app.route('/api/pdf/<key>', methods=['GET'])
+def cached_pdf(key):
+    """Serve a PDF from the cache by the ETag a convert endpoint returned."""
+    if pdf_cache is None or len(key) != 64 or any(c not in '0123456789abcdef' for c in key):
+        return jsonify({'error': 'Not found'}), 404
+    unchanged = not_modified(key)
+    if unchanged is not None:
+        return unchanged
+    cached = pdf_cache.open(key)
+    if cached is None:
+        return jsonify({'error': 'Not cached; convert the document again'}), 404
+    pdf_file, size = cached
+    response = pdf_file_response(pdf_file, size, request.args.get('filename', 'document.pdf'), key)
+    # Content-addressed: the bytes behind a key do not change
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+@app.route('/api/convert-batch', methods=['POST'])
+def convert_batch():
+    """Convert many Markdown documents and stream back a ZIP of PDFs.
+
+    Accepts JSON {"documents": [{"name", "markdown"}], "pageSize"} or a
+    multipart upload of a ZIP of .md files. Per-document failures are
+    reported in manifest.json inside the ZIP.
+    """
+    try:
+        if 'file' in request.files:
+            page_size = request.form.get('pageSize', 'A4')
+            documents = documents_from_zip(
+                request.files['file'].stream, BATCH_MAX_DOCUMENTS, BATCH_MAX_DOCUMENT_BYTES, BATCH_MAX_TOTAL_BYTES
+            )
+        else:
+            data = request.get_json()
+            if not isinstance(data, dict):
+                raise ValueError("Request body must be a JSON object")
+            page_size = data.get('pageSize', 'A4')
+            documents = documents_from_json(data.get('documents', []), BATCH_MAX_DOCUMENTS)
+        
+        if not documents:
+            return jsonify({'error': 'No documents provided', 'success': False}), 400
+        
+        # Refuse before streaming starts; the permit is held until the ZIP ends
+        permit = admission_gates['batch'].acquire(
+            sum(markdown_cost(markdown_text) for _, markdown_text, _ in documents if markdown_text)
+        )
+        
+        process_pool = get_batch_process_pool() if HAS_XHTML2PDF else None
+        client = request_client()
+        
+        def render(markdown_text: str) -> bytes:
+            with metrics.bind_endpoint('convert_batch'), scheduler.bind('bulk', client):
+                return render_pdf_document(build_pdf_document(markdown_text, page_size), page_size, process_pool)
+        
+        def generate():
+            try:
+                yield from stream_pdf_zip(documents, render, workers)
+            finally:
+                permit.release()
+        
+        workers = process_pool.processes if process_pool else 1
+        response = Response(
+            generate(),
+            mimetype='application/zip',
             headers={
-                'Content-Disposition': 'attachment; filename="document.pdf"',
-                'Content-Length': len(pdf_bytes)
+                'Content-Disposition': 'attachment; filename="documents.zip"',
             }
         )
+        # Also covers a client that disconnects before the body starts
+        response.call_on_close(permit.release)
+        return response
     
+    except Overloaded as e:
+        return overloaded_response(e)
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e), 'success': False}), 400
     except Exception as e:
-        return f"Error: {str(e)}", 500
+        return jsonify({'error': str(e), 'success': False}), 500
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a Markdown to PDF conversion and return its job id."""
+    try:
+        data = request.get_json()
+        markdown_text = data.get('markdown', '')
+        page_size = data.get('pageSize', 'A4')
+        filename = data.get('filename', 'document.pdf')
+        
+        if not markdown_text.strip():
+            return jsonify({'error': 'No content provided', 'success': False}), 400
+        
+        job_id = pdf_jobs.submit(markdown_text, page_size, filename, client=request_client())
+        return jsonify({
+            'job_id': job_id,
+            'status_url': f'/api/jobs/{job_id}',
+            'result_url': f'/api/jobs/{job_id}/result',
+            'success': True
+        }), 202
+    
+    except QueueFull as e:
+        response = jsonify({'error': str(e), 'success': False})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the status and progress of a PDF job."""
+    job = pdf_jobs.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job', 'success': False}), 404
+    return jsonify({**job, 'success': True})
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Stream the finished PDF of a job."""
+    job = pdf_jobs.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job', 'success': False}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error'], 'success': False}), 500
+    if job['status'] != 'done':
+        return jsonify({'error': 'Job not finished', 'status': job['status'], 'success': False}), 409
+    
+    return send_file(
+        pdf_jobs.result_path(job_id),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=job['filename']
+    )
 
 
 @app.route('/api/download-markdown', methods=['POST'])
@@ -550,6 +1142,93 @@ def upload():
         return jsonify({'error': str(e)}), 500
 
 
+def upload_stream_info(file) -> 'StreamInfo':
+    """Build MarkItDown stream hints from an uploaded file's name and type."""
+    from markitdown import StreamInfo
+    mimetype = file.mimetype
+    if mimetype in ('', 'application/octet-stream'):
+        mimetype = None
+    return StreamInfo(
+        extension=Path(file.filename).suffix.lower() or None,
+        filename=file.filename,
+        mimetype=mimetype
+    )
+
+
+def doc_cache_key(stream, stream_info: 'StreamInfo', converter: str = 'markitdown') -> str:
+    """Cache key of an upload: content hash, type hint and converter version."""
+    return content_key(stream_digest(stream), stream_info.extension or '', DOC_CACHE_VERSION, converter)
+
+
+def store_doc_cache(cache_key: str, markdown_content: str) -> None:
+    try:
+        doc_cache.set(cache_key, markdown_content.encode('utf-8'))
+    except OSError as e:
+        print(f"Document cache write failed: {e}")
+
+
+def iter_timed_pdf_pages(stream):
+    """iter_pdf_pages, timing each page as a pipeline stage."""
+    pages = iter_pdf_pages(stream)
+    while True:
+        with metrics.stage('markitdown', backend='pdfminer'):
+            page = next(pages, None)
+        if page is None:
+            return
+        yield page
+
+
+def convert_upload_to_markdown(file) -> str:
+    """Convert an uploaded document to Markdown, reusing cached results."""
+    stream_info = upload_stream_info(file)
+    
+    # Convert straight from the upload stream, hinting the file type
+    with seekable_upload(file) as stream:
+        cache_key = None
+        if doc_cache is not None:
+            cache_key = doc_cache_key(stream, stream_info)
+            cached = doc_cache.get(cache_key)
+            if cached is not None:
+                return cached.decode('utf-8')
+        
+        with metrics.stage('markitdown', backend='markitdown'):
+            markdown_content = get_md_converter().convert_stream(stream, stream_info=stream_info).text_content
+    
+    if cache_key is not None:
+        store_doc_cache(cache_key, markdown_content)
+    return markdown_content
+
+
+def iter_upload_sections(file):
+    """Yield (label, markdown) sections of an uploaded document as they are ready.
+
+    PDFs are extracted page by page with pdfminer; other formats are
+    converted by MarkItDown and split per sheet, slide or chunk. The pages
+    are cached under their own key, apart from MarkItDown's output, so a
+    cached stream replays the same pages as a fresh one.
+    """
+    stream_info = upload_stream_info(file)
+    extension = stream_info.extension or ''
+    
+    if extension == '.pdf' and HAS_PDFMINER:
+        with seekable_upload(file) as stream:
+            cache_key = doc_cache_key(stream, stream_info, 'pdfminer pages') if doc_cache else None
+            cached = doc_cache.get(cache_key) if cache_key else None
+            if cached is None:
+                pages = []
+                for label, text in iter_timed_pdf_pages(stream):
+                    pages.append(text)
+                    yield label, text
+                # Only complete conversions are cached
+                if cache_key is not None:
+                    store_doc_cache(cache_key, join_pages(pages))
+                return
+        yield from split_sections(cached.decode('utf-8'), extension)
+        return
+    
+    yield from split_sections(convert_upload_to_markdown(file), extension)
+
+
 @app.route('/api/doc-to-markdown', methods=['POST'])
 def doc_to_markdown():
     """Convert PDF, Word, Excel, PowerPoint to Markdown using MarkItDown."""
@@ -562,32 +1241,73 @@ def doc_to_markdown():
         if file.filename == '':
             return jsonify({'error': 'No file selected', 'success': False}), 400
         
-        # Get file extension
-        filename = file.filename.lower()
-        
-        # Save to temp file for processing
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(filename).suffix) as tmp:
-            file.save(tmp.name)
-            tmp_path = tmp.name
+        with admission_gates['docs'].admit(upload_cost(request.content_length, Path(file.filename).suffix)):
+            markdown_content = convert_upload_to_markdown(file)
         
-        try:
-            # Convert using MarkItDown
-            result = md_converter.convert(tmp_path)
-            markdown_content = result.text_content
-            
-            return jsonify({
-                'markdown': markdown_content,
-                'success': True
-            })
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
+        return jsonify({
+            'markdown': markdown_content,
+            'success': True
+        })
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
 
+@app.route('/api/doc-to-markdown/stream', methods=['POST'])
+def doc_to_markdown_stream():
+    """Convert a document to Markdown, streaming sections as server-sent events."""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided', 'success': False}), 400
+    
+    file = request.files['file']
+    
+    if file.filename == '':
+        return jsonify({'error': 'No file selected', 'success': False}), 400
+    
+    # Refuse before streaming starts; the permit is held until the body ends
+    try:
+        permit = admission_gates['docs'].acquire(upload_cost(request.content_length, Path(file.filename).suffix))
+    except Overloaded as e:
+        return overloaded_response(e)
+    
+    # The body is generated after Flask has closed the request's files
+    file = detach_upload(file)
+    
+    def generate():
+        sections = 0
+        # Runs after the request has been torn down
+        token = metrics.set_endpoint('doc_to_markdown_stream')
+        try:
+            for label, markdown_content in iter_upload_sections(file):
+                sections += 1
+                yield sse_event('section', {
+                    'index': sections,
+                    'label': label,
+                    'markdown': markdown_content
+                })
+            yield sse_event('done', {'sections': sections, 'success': True})
+        except Exception as e:
+            yield sse_event('error', {'error': str(e), 'success': False})
+        finally:
+            metrics.reset_endpoint(token)
+            file.close()
+            permit.release()
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # Also covers a client that disconnects before the body starts
+    response.call_on_close(permit.release)
+    return response
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 7861))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,132 @@
+"""
+MarkForge - Upload stream helpers
+Hands uploaded files to converters as seekable streams without writing a
+second copy to disk. Only uploads that are not already buffered binary
+streams are spilled to a temporary file, which is then read through a
+memory map.
+"""
+
+import io
+import mmap
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from flask import Request
+from werkzeug.datastructures import FileStorage
+
+# Uploads up to this size are parsed into memory, larger ones into a temp file
+IN_MEMORY_UPLOAD_BYTES = 500 * 1024
+SPILL_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadRequest(Request):
+    """Request class that buffers uploads in BytesIO or a plain temp file.
+
+    Werkzeug's default SpooledTemporaryFile is not an io.BufferedIOBase,
+    which MarkItDown's type detection requires, so it would force a copy.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= IN_MEMORY_UPLOAD_BYTES:
+            return io.BytesIO()
+        return tempfile.TemporaryFile('w+b')
+
+
+class MappedStream(io.RawIOBase):
+    """Read-only, seekable binary stream over a memory map."""
+
+    def __init__(self, mapped: mmap.mmap):
+        super().__init__()
+        self._mapped = mapped
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), len(self._mapped))
+        count = end - self._position
+        if count <= 0:
+            return 0
+        buffer[:count] = self._mapped[self._position:end]
+        self._position = end
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._mapped) + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if position < 0:
+            raise ValueError("negative seek position")
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        if not self.closed:
+            self._mapped.close()
+        super().close()
+
+
+def _is_buffered_seekable(stream) -> bool:
+    try:
+        return isinstance(stream, io.BufferedIOBase) and stream.seekable()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def seekable_upload(file_storage):
+    """Yield a seekable binary stream for an uploaded werkzeug FileStorage.
+
+    With UploadRequest the parsed upload is already a buffered, seekable
+    stream and is used as-is. Anything else is spilled once to an
+    anonymous temp file and memory-mapped.
+    """
+    stream = file_storage.stream
+    if _is_buffered_seekable(stream):
+        stream.seek(0)
+        yield stream
+        return
+
+    with tempfile.TemporaryFile() as spill:
+        shutil.copyfileobj(stream, spill, SPILL_CHUNK_BYTES)
+        spill.flush()
+        if spill.tell() == 0:
+            yield io.BytesIO(b'')
+            return
+        mapped = mmap.mmap(spill.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = io.BufferedReader(MappedStream(mapped))
+        try:
+            yield reader
+        finally:
+            reader.close()
+
+
+def detach_upload(file_storage) -> FileStorage:
+    """Take ownership of an upload's stream so it outlives the request.
+
+    Flask closes uploaded files when the request context is torn down,
+    which happens before a streamed response body is generated. The caller
+    must close the returned FileStorage.
+    """
+    detached = FileStorage(
+        stream=file_storage.stream,
+        filename=file_storage.filename,
+        name=file_storage.name,
+        headers=file_storage.headers,
+    )
+    file_storage.stream = io.BytesIO()
+    return detached
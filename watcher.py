@@ -0,0 +1,261 @@
+"""
+MarkForge - File change watching for the CLI's watch mode
+Uses inotify through ctypes on Linux and falls back to polling file stats
+elsewhere, or when inotify is unavailable or out of watches. Also provides
+the restartable render worker that lets a newer save cancel an in-flight
+render.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import signal
+import struct
+import sys
+import time
+
+POLL_INTERVAL = float(os.environ.get('MARKFORGE_WATCH_POLL_SECONDS', 0.5))
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# A finished save is a file closed after writing, or one renamed into place
+# (editors that write a temp file first); creations only matter for
+# directories, which need watches of their own
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _walk_dirs(root: str):
+    """root and every directory below it, skipping hidden ones."""
+    yield root
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in dirnames:
+            yield os.path.join(dirpath, name)
+
+
+def _walk_files(root: str):
+    for directory in _walk_dirs(root):
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_file():
+                yield entry.path
+
+
+class InotifyWatcher:
+    """Recursive directory watcher on Linux inotify, called through ctypes."""
+
+    backend = 'inotify'
+
+    def __init__(self, roots: list):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.roots = roots
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._dirs = {}
+        try:
+            for root in roots:
+                for directory in _walk_dirs(root):
+                    self._add(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # Gone again before it could be watched
+                return
+            # ENOSPC: out of watches (fs.inotify.max_user_watches)
+            raise OSError(error, f'{directory}: {os.strerror(error)}')
+        self._dirs[wd] = directory
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def next_timeout(self):
+        return None
+
+    def read(self) -> set:
+        """Return the paths changed since the last read, without blocking."""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            if not data:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped: report everything and let the
+                    # caller's content check find what really changed
+                    for root in self.roots:
+                        changed.update(_walk_files(root))
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith('.'):
+                        # A new directory, possibly moved in with files
+                        for subdirectory in _walk_dirs(path):
+                            self._add(subdirectory)
+                        changed.update(_walk_files(path))
+                    continue
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    changed.add(path)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """Watcher that rescans file sizes and mtimes every interval seconds."""
+
+    backend = 'polling'
+
+    def __init__(self, roots: list, interval: float = POLL_INTERVAL):
+        self.roots = roots
+        self.interval = max(interval, 0.05)
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + self.interval
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        for root in self.roots:
+            for path in _walk_files(root):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def fileno(self):
+        return None
+
+    def next_timeout(self) -> float:
+        return max(0.0, self._next_scan - time.monotonic())
+
+    def read(self) -> set:
+        if time.monotonic() < self._next_scan:
+            return set()
+        snapshot = self._scan()
+        self._next_scan = time.monotonic() + self.interval
+        changed = {path for path, stat in snapshot.items() if self._snapshot.get(path) != stat}
+        changed.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(roots: list, polling: bool = False):
+    """Return an inotify watcher, or a polling one if inotify is unavailable."""
+    if not polling:
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as e:
+            # AttributeError: a libc without the inotify functions
+            if sys.platform.startswith('linux'):
+                print(f"inotify unavailable ({e}); polling every {POLL_INTERVAL:g}s")
+    return PollingWatcher(roots)
+
+
+def _worker_main(conn, job_function, initializer) -> None:
+    """Render worker loop: run each job received on conn and send back the result."""
+    # Ctrl+C reaches the whole process group; the parent shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        conn.send(job_function(*job))
+
+
+class RenderWorker:
+    """A child process running one job at a time that can be killed mid-job.
+
+    A render cannot be interrupted inside xhtml2pdf, so cancelling kills
+    the process and starts a fresh one, which runs the initializer (the
+    pipeline imports) while the next save is being debounced.
+    """
+
+    def __init__(self, context, job_function, initializer=None):
+        self.context = context
+        self.job_function = job_function
+        self.initializer = initializer
+        self.job = None
+        self._start()
+
+    def _start(self) -> None:
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main, args=(child_conn, self.job_function, self.initializer),
+            name='markforge-watch-worker', daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    @property
+    def busy(self) -> bool:
+        return self.job is not None
+
+    def submit(self, job) -> None:
+        self.job = job
+        self.conn.send(job)
+
+    def result(self):
+        """Return (job, result) for the finished job; result is None if the process died."""
+        job, self.job = self.job, None
+        try:
+            return job, self.conn.recv()
+        except (EOFError, OSError):
+            self.restart()
+            return job, None
+
+    def restart(self) -> None:
+        """Kill the process, dropping its job, and start a fresh one."""
+        self.job = None
+        self.close()
+        self._start()
+
+    def close(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
@@ -5,13 +5,18 @@ Enterprise-grade document conversion by Zorost Intelligence
 """
 
 import gradio as gr
-import markdown
 from xhtml2pdf import pisa
 import tempfile
 import io
 import os
 from pathlib import Path
 
+from code_highlight import GUESS_MAX_BLOCKS
+from pdf_styles import get_pdf_style, install_stylesheet_cache
+from pdf_tables import split_large_tables
+from render_pool import get_renderer_pool
+from reproducible import REPRODUCIBLE, pin_xhtml2pdf
+
 # Professional PDF CSS
 PDF_CSS = """
 @page {
@@ -124,6 +129,14 @@ tr:nth-child(even) td {
     background-color: #f8fafc;
 }
 
+.large-table {
+    margin: 16pt 0;
+}
+
+table.table-chunk {
+    margin: 0;
+}
+
 ul, ol {
     margin-bottom: 12pt;
     padding-left: 24pt;
@@ -293,19 +306,11 @@ CUSTOM_CSS = """
 """
 
 
-def convert_md_to_html(markdown_text: str) -> str:
+def convert_md_to_html(markdown_text: str, guess_budget_ms: float = None,
+                       guess_max_blocks: int = None) -> str:
     """Convert Markdown to HTML."""
-    md = markdown.Markdown(
-        extensions=[
-            'tables',
-            'fenced_code',
-            'codehilite',
-            'toc',
-            'nl2br',
-            'sane_lists',
-        ]
-    )
-    return md.convert(markdown_text)
+    return get_renderer_pool().convert(markdown_text, guess_budget_ms=guess_budget_ms,
+                                       guess_max_blocks=guess_max_blocks)
 
 
 def generate_pdf(markdown_text: str, page_size: str = "A4", 
@@ -314,31 +319,23 @@ def generate_pdf(markdown_text: str, page_size: str = "A4",
     if not markdown_text.strip():
         return None
     
-    # Convert Markdown to HTML
-    html_content = convert_md_to_html(markdown_text)
+    # Convert Markdown to HTML, splitting large tables for fast layout
+    html_content = split_large_tables(
+        convert_md_to_html(markdown_text, float('inf'), GUESS_MAX_BLOCKS) if REPRODUCIBLE
+        else convert_md_to_html(markdown_text)
+    )
     
     # Build header/footer sections
     header_html = f'<div class="header-text">{header_text}</div>' if header_text else ""
     footer_html = f'<div class="footer-text">{footer_text}</div>' if footer_text else ""
     
-    # Page size mapping
-    page_sizes = {
-        "A4": "a4 portrait",
-        "Letter": "letter portrait",
-        "Legal": "legal portrait",
-        "A3": "a3 portrait",
-        "A5": "a5 portrait",
-    }
-    
-    page_css = PDF_CSS.replace("size: a4 portrait;", f"size: {page_sizes.get(page_size, 'a4 portrait')};")
-    
     # Build full HTML document
     full_html = f"""
     <!DOCTYPE html>
     <html>
     <head>
         <meta charset="UTF-8">
-        <style>{page_css}</style>
+        {get_pdf_style(PDF_CSS, page_size).style_tags}
     </head>
     <body>
         {header_html}
@@ -352,6 +349,9 @@ def generate_pdf(markdown_text: str, page_size: str = "A4",
     with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
         output_path = f.name
     
+    install_stylesheet_cache()
+    if REPRODUCIBLE:
+        pin_xhtml2pdf()
     with open(output_path, "wb") as pdf_file:
         pisa_status = pisa.CreatePDF(full_html, dest=pdf_file)
     